@@ -0,0 +1,107 @@
+"""Микробенчмарк JSON-кодека: stdlib json против активного бэкенда utils.jsoncodec.
+
+Запуск из корня проекта: python benchmarks/json_codec.py [--rows 5000]
+Меряет разбор/сериализацию типичного профиля Raider.IO и разбор LFG-строк
+(dps + embed_json на строку, как в Database.get_lfg при ленивой загрузке сбора).
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+# Обеспечиваем корректную загрузку пакета при запуске модуля напрямую
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from utils import jsoncodec
+
+SLOTS = ["head", "neck", "shoulder", "back", "chest", "waist", "legs", "feet",
+         "wrist", "hands", "finger1", "finger2", "trinket1", "trinket2", "mainhand", "offhand"]
+DUNGEONS = ["Ara-Kara, City of Echoes", "Priory of the Sacred Flame", "The Dawnbreaker", "Halls of Atonement",
+            "Tazavesh, the Veiled Market: Streets of Wonder", "Tazavesh, the Veiled Market: So'leah's Gambit",
+            "Operation: Floodgate", "Eco-Dome Al'dani"]
+
+
+def make_profile() -> dict:
+    """Профиль по форме ответа /characters/profile с полями full."""
+    def run(i, level):
+        return {
+            "dungeon": DUNGEONS[i % len(DUNGEONS)], "short_name": f"D{i}", "mythic_level": level,
+            "completed_at": "2025-09-30T19:12:44.000Z", "clear_time_ms": 1834000 + i * 1000,
+            "par_time_ms": 1980000, "num_keystone_upgrades": 1 + i % 3, "map_challenge_mode_id": 500 + i,
+            "zone_id": 14000 + i, "score": 380.5 - i, "affixes": [
+                {"id": 10, "name": "Fortified", "description": "Не являющиеся боссами противники получают больше здоровья.",
+                 "icon": "ability_toughness", "wowhead_url": "https://wowhead.com/affix=10"},
+            ],
+            "url": f"https://raider.io/mythic-plus-runs/season-tww-3/{i}",
+        }
+
+    return {
+        "name": "Примерный", "race": "Orc", "class": "Warrior", "active_spec_name": "Protection",
+        "active_spec_role": "TANK", "gender": "male", "faction": "horde", "achievement_points": 21450,
+        "thumbnail_url": "https://render.worldofwarcraft.com/eu/character/gordunni/1/2-avatar.jpg",
+        "region": "eu", "realm": "Gordunni", "last_crawled_at": "2025-10-01T10:00:00.000Z",
+        "profile_url": "https://raider.io/characters/eu/gordunni/Примерный",
+        "guild": {"name": "Ключники", "realm": "Gordunni"},
+        "gear": {
+            "updated_at": "2025-10-01T10:00:00.000Z", "item_level_equipped": 711, "item_level_total": 711,
+            "items": {slot: {"item_id": 200000 + i, "item_level": 711, "enchant": 7000 + i, "icon": f"inv_{slot}",
+                             "name": f"Предмет {slot}", "item_quality": 4, "is_legendary": False,
+                             "bonuses": [10000 + i, 10500, 11000], "gems": [213746]}
+                      for i, slot in enumerate(SLOTS)},
+        },
+        "mythic_plus_scores_by_season": [{"season": "season-tww-3", "scores": {
+            "all": 3124.6, "dps": 0, "healer": 0, "tank": 3124.6, "spec_0": 0, "spec_1": 0, "spec_2": 3124.6}}],
+        "mythic_plus_best_runs": [run(i, 14 + i % 4) for i in range(8)],
+        "mythic_plus_weekly_highest_level_runs": [run(i, 12 + i % 5) for i in range(8)],
+    }
+
+
+def make_lfg_rows(n: int) -> list[tuple[str, str]]:
+    """(dps_json, embed_json) как их хранит Database.save_lfg."""
+    embed = {
+        "title": "🔥 Сбор: +15 Ara-Kara, City of Echoes", "color": 15844367, "type": "rich",
+        "description": "👑 **Лидер:** <@123456789012345678>\n📝 **Инфо:** Нужен танк с 3000+",
+        "fields": [
+            {"name": "<:tank:1447918344337621002> Танк", "value": "Пусто", "inline": True},
+            {"name": "<:healer:1447918402218885231> Лекарь", "value": "Пусто", "inline": True},
+            {"name": "<:DPS:1447918367569612871> Бойцы", "value": "Пусто", "inline": True},
+        ],
+    }
+    dps = [123456789012345678, 223456789012345678]
+    return [(json.dumps(dps), json.dumps(embed)) for _ in range(n)]
+
+
+def bench(label: str, fn, number: int) -> float:
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<28} {best * 1e6:10.1f} мкс")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="число LFG-строк для разбора")
+    args = parser.parse_args()
+
+    profile = make_profile()
+    raw = json.dumps(profile).encode("utf-8")
+    rows = make_lfg_rows(args.rows)
+    print(f"Бэкенд utils.jsoncodec: {jsoncodec.BACKEND}; профиль {len(raw)} байт, {args.rows} LFG-строк")
+
+    cases = [
+        ("profile loads", lambda: json.loads(raw), lambda: jsoncodec.loads(raw), 2000),
+        ("profile dumps", lambda: json.dumps(profile), lambda: jsoncodec.dumps_bytes(profile), 2000),
+        ("LFG rows", lambda: [(json.loads(d), json.loads(e)) for d, e in rows],
+         lambda: [(jsoncodec.loads(d), jsoncodec.loads(e)) for d, e in rows], 5),
+    ]
+    for label, stdlib_fn, codec_fn, number in cases:
+        print(label)
+        base = bench("stdlib json", stdlib_fn, number)
+        fast = bench(jsoncodec.BACKEND, codec_fn, number)
+        print(f"  ускорение: x{base / fast:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Нагрузочная проверка LFGPost: сотни одновременных кликов по нескольким сборам.
+
+Запуск из корня проекта: python benchmarks/lfg_clicks.py [--posts 20] [--users 50] [--clicks 500]
+Без Discord и БД: клики идут прямо в LFGPost.submit(). После каждого изменения проверяется,
+что слоты не задвоены, версии идут подряд, а объявление «группа собрана» приходится
+ровно на каждый переход «не собрана → собрана».
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+# Обеспечиваем корректную загрузку пакета при запуске модуля напрямую
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from utils.lfg import DPS_SLOTS, ROLES, LFGPost, LFGState
+
+
+def check_state(state: LFGState) -> None:
+    members = state.members
+    assert len(members) == len(set(members)), f"двойная запись: {state}"
+    assert len(state.dps) <= DPS_SLOTS, f"переполнены ДД: {state}"
+
+
+async def run(posts: int, users: int, clicks: int, seed: int) -> int:
+    rng = random.Random(seed)
+    changes: dict[int, list[tuple[LFGState, LFGState]]] = {}
+
+    def on_change(old: LFGState, new: LFGState) -> None:
+        assert new.version == old.version + 1, f"пропуск версии: {old.version} → {new.version}"
+        check_state(new)
+        changes[new.message_id].append((old, new))
+
+    board = []
+    for mid in range(1, posts + 1):
+        changes[mid] = []
+        board.append(LFGPost(LFGState(mid, 0, 0), on_change))
+
+    announced: dict[int, int] = {post.message_id: 0 for post in board}
+
+    async def click(post: LFGPost, user_id: int, role: str) -> None:
+        # Случайная задержка перемешивает порядок прихода кликов
+        await asyncio.sleep(rng.random() * 0.005)
+        old, new = await post.submit(role, user_id)
+        if new is not None and new.is_full and not old.is_full:
+            announced[post.message_id] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        click(rng.choice(board), rng.randrange(1, users + 1), rng.choice(ROLES))
+        for _ in range(clicks)
+    ))
+    elapsed = time.perf_counter() - started
+
+    failures = 0
+    for post in board:
+        log = changes[post.message_id]
+        transitions = sum(1 for old, new in log if new.is_full and not old.is_full)
+        if transitions != announced[post.message_id]:
+            failures += 1
+            print(f"LFG {post.message_id}: переходов {transitions}, объявлений {announced[post.message_id]}")
+        if post.state.version != len(log):
+            failures += 1
+            print(f"LFG {post.message_id}: версия {post.state.version}, изменений {len(log)}")
+
+    applied = sum(len(log) for log in changes.values())
+    full = sum(announced.values())
+    print(f"кликов: {clicks}, применено: {applied}, отклонено: {clicks - applied}, "
+          f"объявлений: {full}, время: {elapsed * 1000:.1f} мс")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--clicks", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    failures = asyncio.run(run(args.posts, args.users, args.clicks, args.seed))
+    print("OK" if not failures else f"ошибок: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
 import io
+from utils import memory, tracing
+from utils.cache import cache
 
 class General(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -12,6 +15,35 @@ class General(commands.Cog):
         latency = round(self.bot.latency * 1000)  # Задержка в миллисекундах
         await interaction.response.send_message(f"Pong! Задержка: {latency} мс")
 
+    @app_commands.command(name="startup", description="Профиль последнего запуска бота (для администраторов)")
+    @app_commands.default_permissions(administrator=True)
+    async def startup(self, interaction: discord.Interaction):
+        await interaction.response.send_message(f"```\n{self.bot.startup.report()}\n```", ephemeral=True)
+
+    @app_commands.command(name="memory", description="Память бота по подсистемам (для администраторов)")
+    @app_commands.default_permissions(administrator=True)
+    async def memory_usage(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        bot = self.bot
+        counts = {
+            "гильдии": len(bot.guilds),
+            "пользователи (кэш)": len(bot.users),
+            "участники (кэш)": sum(len(g.members) for g in bot.guilds),
+            "сообщения (кэш)": len(bot.cached_messages),
+        }
+        for name, stats in cache.all_stats().items():
+            counts[f"кэш {name}"] = stats["size"]
+        counts["LFG: ждут записи"] = len(bot.lfg_writer)
+        counts["LFG: ждут правки"] = len(bot.lfg_edits)
+        # Разбор снимка tracemalloc — в потоке, чтобы не держать цикл событий
+        report = await asyncio.to_thread(memory.memory_report, counts)
+        await interaction.followup.send(f"```\n{report[:1900]}\n```", ephemeral=True)
+
+    @app_commands.command(name="latency", description="Задержка ответа по командам: p50/p95/p99 (для администраторов)")
+    @app_commands.default_permissions(administrator=True)
+    async def latency(self, interaction: discord.Interaction):
+        await interaction.response.send_message(f"```\n{tracing.latency_report()[:1900]}\n```", ephemeral=True)
+
     async def get_emojis(self, interaction: discord.Interaction):
         if not interaction.guild:
             await interaction.response.send_message("Команда работает только на сервере.", ephemeral=True)
@@ -1,12 +1,21 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-from typing import Optional, List
+from typing import Optional
 import asyncio
 import logging
-import json
-from utils.raiderio import get_character_data
-from utils.cache import cache
+import os
+import time
+from utils import cluster, jsoncodec, metrics, tracing
+from utils.lfg import DPS_SLOTS, LFGPost, LFGState
+# Очистка истёкших сборов: период (мин), размер пачки удаления и нужно ли помечать сообщение как истёкшее
+LFG_SWEEP_MINUTES = float(os.getenv("LFG_SWEEP_MINUTES", "10"))
+LFG_SWEEP_BATCH = int(os.getenv("LFG_SWEEP_BATCH", "100"))
+LFG_MARK_EXPIRED = os.getenv("LFG_MARK_EXPIRED", "1") == "1"
+
+LFG_CLICKS = metrics.counter("lfg_clicks_total", "Клики по кнопкам ролей LFG по результату", ["role", "result"])
+LFG_POSTS = metrics.counter("lfg_posts_total", "Сборы LFG по событию (created/closed/expired)", ["event"])
+
 # --- КОНФИГУРАЦИЯ ИКОНОК ---
 
 # ID взяты с сервера пользователя
@@ -54,459 +63,276 @@ DUNGEON_CHOICES = [
     {"name": "Операция «Шлюз»", "value": "Operation: Floodgate"},
     {"name": "Заповедник «Аль'дани»", "value": "Eco-Dome Al'dani"},
 ]
-class RoleButton(discord.ui.Button):
-    def __init__(self, role: str, style: discord.ButtonStyle, custom_id: str):
-        super().__init__(label=role, style=style, custom_id=custom_id)
+class LFGRoleButton(discord.ui.DynamicItem[discord.ui.Button], template=r"lfg:(?P<message_id>[0-9]+):(?P<role>tank|healer|dps)"):
+    """Кнопка записи на роль. Один обработчик на все сборы: состояние берётся из bot.lfg_store по message_id."""
+
+    LABELS = {
+        "tank": ("Танк", discord.ButtonStyle.primary),
+        "healer": ("Хил", discord.ButtonStyle.success),
+        "dps": ("ДД", discord.ButtonStyle.danger),
+    }
+
+    def __init__(self, message_id: int, role: str, disabled: bool = False):
+        label, style = self.LABELS[role]
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=f"lfg:{message_id}:{role}", disabled=disabled))
+        self.message_id = message_id
         self.role = role
 
-    async def callback(self, interaction: discord.Interaction):
-        # Delegate handling to parent view
-        view: KeyView = self.view  # type: ignore
-        if self.role == 'Танк':
-            await view.handle_tank(interaction)
-        elif self.role == 'Хил':
-            await view.handle_healer(interaction)
-        elif self.role == 'ДД':
-            await view.handle_dps(interaction)
-
-        # После изменения слотов обновляем embed и состояние кнопок и редактируем сообщение
-        try:
-            new_embed = await view.update_embed()
-            await view.update_buttons(interaction, new_embed)
-            # Обновляем сообщение
-            try:
-                await interaction.response.edit_message(embed=new_embed, view=view)
-            except Exception:
-                # Иногда response может быть уже выполнен (ephemeral), в таком случае используем followup
-                try:
-                    await interaction.followup.edit_message(interaction.message.id, embed=new_embed, view=view)  # type: ignore
-                except Exception:
-                    # последний шанс: fetch original response and edit
-                    try:
-                        orig = await interaction.original_response()
-                        await orig.edit(embed=new_embed, view=view)
-                    except Exception:
-                        logging.getLogger(__name__).exception("Failed to edit LFG message after role change")
-        except Exception:
-            logging.getLogger(__name__).exception("Failed to update embed/buttons after role change")
-
-
-class PersistentRoleButton(discord.ui.Button):
-    def __init__(self, role: str, style: discord.ButtonStyle, custom_id: str, delegate_role: str):
-        super().__init__(label=role, style=style, custom_id=custom_id)
-        self.delegate_role = delegate_role
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["message_id"]), match["role"])
 
+    @tracing.traced("lfg:role")
     async def callback(self, interaction: discord.Interaction):
-        view = self.view
-        # delegate to view's _delegate method if available
-        if hasattr(view, '_delegate'):
-            await view._delegate(interaction, self.delegate_role)
-        else:
-            # fallback: try to find cog and call handler
-            try:
-                cog = getattr(view, 'cog', None)
-                if cog:
-                    await cog._handle_persistent_interaction(view.message_id, self.delegate_role, interaction)
-            except Exception:
-                logging.getLogger(__name__).exception('Failed to delegate persistent role button')
-
-
-class KeyView(discord.ui.View):
-    def __init__(self, bot, author_id, embed_template: Optional[discord.Embed] = None, message_id: int | None = None, tank: int | None = None, healer: int | None = None, dps: list | None = None):
-        super().__init__(timeout=None)
-        self.bot = bot
-        self.author_id = author_id
+        bot = interaction.client
+        post = await bot.lfg_store.get(self.message_id)  # type: ignore[attr-defined]
+        if post is None:
+            LFG_CLICKS.inc(role=self.role, result="missing")
+            await interaction.response.send_message("Сбор не найден или уже закрыт.", ephemeral=True)
+            return
+        # Клики по одному сбору применяются по очереди; дальше работаем только со снимками
+        old, new = await post.submit(self.role, interaction.user.id)
+        if post.closed:
+            LFG_CLICKS.inc(role=self.role, result="closed")
+            await interaction.response.send_message("Сбор не найден или уже закрыт.", ephemeral=True)
+            return
+        if new is None:
+            LFG_CLICKS.inc(role=self.role, result="taken")
+            await interaction.response.send_message("Слот уже занят", ephemeral=True)
+            return
+        LFG_CLICKS.inc(role=self.role, result="applied")
+
+        # Клик подтверждаем сразу, а сообщение правим отложенно: клики внутри окна склеиваются
+        # в одну правку, последней всегда уходит актуальная отрисовка
+        await interaction.response.defer()
+        channel = interaction.channel
+        # Объявляем только на переходе «не собрана → собрана»: его видит ровно один клик
+        if new.is_full and not old.is_full:
+            await announce_full(channel, new)
+        template = interaction.message.embeds[0] if interaction.message and interaction.message.embeds else None
+        bot.lfg_edits.request(self.message_id, lambda: render_lfg_message(bot, post, channel, template))  # type: ignore[attr-defined]
+
+
+async def announce_full(channel, state: LFGState):
+    mentions = " ".join(f"<@{uid}>" for uid in state.members)
+    try:
+        if channel:
+            await channel.send(f"Группа собрана! 🚀 {mentions}")
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to send full party announcement")
+
+
+async def render_lfg_message(bot, post: LFGPost, channel, template: Optional[discord.Embed] = None):
+    """Отрисовывает последний снимок сбора и правит сообщение (вызывается из bot.lfg_edits)."""
+    view = KeyView(bot, post, template)
+    try:
+        new_embed = await view.update_embed()
+        view.update_buttons()
+        await channel.get_partial_message(post.message_id).edit(embed=new_embed, view=view)
+    finally:
+        # View нужна только для отрисовки: клики обрабатывает динамический обработчик
+        view.stop()
+
+
+class LFGCloseButton(discord.ui.DynamicItem[discord.ui.Button], template=r"(?:lfg:(?P<message_id>[0-9]+):close|close_lfg)"):
+    """Кнопка закрытия сбора (close_lfg — custom_id старых сообщений)."""
+
+    def __init__(self, message_id: int):
+        super().__init__(discord.ui.Button(label="⛔ Закрыть", style=discord.ButtonStyle.red, custom_id=f"lfg:{message_id}:close"))
         self.message_id = message_id
 
-        # Состояние: храним id пользователей
-        self.tank: Optional[int] = None
-        self.healer: Optional[int] = None
-        self.dps: List[int] = []
-
-        # Шаблонный embed для обновления (копируем чтобы избежать мутаций извне)
-        self.embed_template = embed_template.copy() if embed_template else None
-        # Флаг, что группа уже была объявлена собранной
-        self.full_announced = False
-        # Восстановление слотов из переданных аргументов
-        self.tank: Optional[int] = tank
-        self.healer: Optional[int] = healer
-        self.dps: List[int] = dps or []
-
-        # Создаём персистентные кнопки с custom_id, зависящим от message_id
-        mid = str(self.message_id) if self.message_id else 'tmp'
-        self.add_item(RoleButton('Танк', discord.ButtonStyle.primary, custom_id=f"lfg:{mid}:tank"))
-        self.add_item(RoleButton('Хил', discord.ButtonStyle.success, custom_id=f"lfg:{mid}:healer"))
-        self.add_item(RoleButton('ДД', discord.ButtonStyle.danger, custom_id=f"lfg:{mid}:dps"))
-        self.add_item(CloseLFGButton(self.author_id))
-
-
-class CloseLFGButton(discord.ui.Button):
-    def __init__(self, author_id):
-        super().__init__(label="⛔ Закрыть", style=discord.ButtonStyle.red, custom_id="close_lfg")
-        self.author_id = author_id
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        message_id = match["message_id"] or (interaction.message.id if interaction.message else 0)
+        return cls(int(message_id))
 
+    @tracing.traced("lfg:close")
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.author_id:
+        store = interaction.client.lfg_store  # type: ignore[attr-defined]
+        post = await store.get(self.message_id)
+        if post is None:
+            await interaction.response.send_message("Сбор не найден или уже закрыт.", ephemeral=True)
+            return
+        if interaction.user.id != post.state.author_id:
             await interaction.response.send_message("Только лидер группы может отменить сбор.", ephemeral=True)
             return
         try:
             await interaction.message.delete()
         except Exception:
             pass
-        self.view.stop()
+        store.discard(self.message_id)
+        interaction.client.lfg_edits.cancel(self.message_id)  # type: ignore[attr-defined]
+        LFG_POSTS.inc(event="closed")
+        try:
+            await interaction.client.db.delete_lfg(self.message_id)  # type: ignore[attr-defined]
+        except Exception:
+            logging.getLogger(__name__).exception("Failed to delete LFG %s from DB", self.message_id)
         await interaction.response.send_message("Сбор отменен.", ephemeral=True)
 
-    def _remove_user_from_all(self, user_id: int):
-        if self.tank == user_id:
-            self.tank = None
-        if self.healer == user_id:
-            self.healer = None
-        self.dps = [uid for uid in self.dps if uid != user_id]
 
-    def _format_mentions(self, uids: List[int]) -> str:
-        if not uids:
-            return "Пусто"
-        return ", ".join(f"<@{uid}>" for uid in uids)
+class KeyView(discord.ui.View):
+    """Отрисовка снимка сбора: кнопки и embed. Сама view не регистрируется и не хранит состояние."""
+
+    def __init__(self, bot, post: LFGPost, embed_template: Optional[discord.Embed] = None):
+        super().__init__(timeout=None)
+        self.bot = bot
+        self.post = post
+        # Снимок на момент отрисовки: клики, пришедшие во время неё, попадут в следующую правку
+        self.state = state = post.state
+
+        # Шаблонный embed: сохранённый при создании сбора (разбирается только при промахе кэша отрисовки),
+        # иначе текущий embed сообщения
+        self.embed_template = embed_template
+
+        mid = state.message_id
+        self.add_item(LFGRoleButton(mid, "tank"))
+        self.add_item(LFGRoleButton(mid, "healer"))
+        self.add_item(LFGRoleButton(mid, "dps"))
+        self.add_item(LFGCloseButton(mid))
 
     async def _fetch_stats_for(self, user_id: int) -> tuple[Optional[float], Optional[int]]:
         """Возвращает (rio_score, item_level) для пользователя по discord_id.
-        Сначала пытается взять из in-memory кэша, затем из базы; если в базе есть запись,
-        создаёт асинхронную задачу для обновления кэша через Raider.IO (fire-and-forget).
+        Свежие и устаревшие значения отдаются сразу из кэша bot.member_stats (устаревшие
+        обновляются в фоне, не больше одного обновления на пользователя); при пустом кэше
+        значение берётся из базы.
         """
         try:
-            # 1) Попытка взять из кэша
-            cached = await cache.get(user_id)
-            if cached:
-                return cached  # ожидаемый формат (rio, ilvl)
-
-            # 2) Попытка получить из локальной БД
-            user_row = None
-            if hasattr(self.bot, 'db') and self.bot.db:
-                try:
-                    user_row = await self.bot.db.get_user(user_id)
-                except Exception as e:
-                    logging.getLogger(__name__).exception(f"DB error fetching user {user_id}: {e}")
-
-            rio = None
-            item_level = None
-
-            if user_row:
-                # user_row: (discord_id, character_name, realm_slug, region, rio_score, character_class, thumbnail_url[, item_level])
-                try:
-                    # Use index access to be resilient to schema changes
-                    character_name = user_row[1]
-                    realm_slug = user_row[2]
-                    region = user_row[3]
-                    rio_score = user_row[4]
-                    # optional item_level at index 7
-                    item_level = user_row[7] if len(user_row) > 7 else None
-                    rio = rio_score
-                except Exception:
-                    rio = None
-
-                # Запускаем фоновую задачу для обновления кэша и БД, но не ждём её
-                try:
-                    asyncio.create_task(self._refresh_and_update_cache(user_id, character_name, realm_slug, region))
-                except Exception:
-                    logging.getLogger(__name__).debug("Не удалось создать задачу обновления кэша")
-
-            return rio, item_level
+            char = await self.bot.member_stats.get(user_id)
+            return char.stats if char else (None, None)
         except Exception:
             logging.getLogger(__name__).exception(f"Unexpected error fetching stats for user {user_id}")
             return None, None
 
-    async def _refresh_and_update_cache(self, user_id: int, character_name: str, realm_slug: str, region: str, ttl: int = 300):
-        """Обновляет данные пользователя: делает запрос к Raider.IO и размещает результат в кэше.
-        Также обновляет запись в БД (register_user) при успешном получении данных.
-        """
-        try:
-            # Сетевой запрос с таймаутом
-            coro = get_character_data(character_name, realm_slug, region)
-            data = await asyncio.wait_for(coro, timeout=8)
-            if not data:
-                return
-
-            new_score = data.get("mythic_plus_scores_by_season", [{}])[0].get("scores", {}).get("all")
-            new_item_level = data.get('gear', {}).get('item_level_equipped')
-            new_class = data.get('class')
-            new_thumbnail = data.get('thumbnail_url')
-
-            # Сохраняем в кэш
-            try:
-                await cache.set(user_id, (new_score, new_item_level), ttl=ttl)
-            except Exception:
-                logging.getLogger(__name__).debug(f"Failed to set cache for {user_id}")
-
-            # Обновляем БД (если доступна)
-            if hasattr(self.bot, 'db') and self.bot.db and new_score is not None:
-                try:
-                    await self.bot.db.register_user(user_id, character_name, realm_slug, region, new_score, new_class, new_thumbnail, new_item_level)
-                except Exception:
-                    logging.getLogger(__name__).exception(f"Failed to update DB for {character_name}")
-
-        except asyncio.TimeoutError:
-            logging.getLogger(__name__).warning(f"Timeout refreshing Raider.IO for {character_name} ({realm_slug})")
-        except Exception:
-            logging.getLogger(__name__).exception(f"Error refreshing Raider.IO for {character_name} ({realm_slug})")
-
-    async def handle_tank(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-        # Toggle off
-        if self.tank == user_id:
-            self.tank = None
-            await self._persist_slots()
-            return
-
-        if self.tank is not None and self.tank != user_id:
-            await interaction.response.send_message("Слот уже занят", ephemeral=True)
-            return
-
-        self._remove_user_from_all(user_id)
-        self.tank = user_id
-        await self._persist_slots()
-
-    async def handle_healer(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-        if self.healer == user_id:
-            self.healer = None
-            await self._persist_slots()
-            return
-
-        if self.healer is not None and self.healer != user_id:
-            await interaction.response.send_message("Слот уже занят", ephemeral=True)
-            return
-
-        self._remove_user_from_all(user_id)
-        self.healer = user_id
-        await self._persist_slots()
-
-    async def handle_dps(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-        if user_id in self.dps:
-            self.dps = [uid for uid in self.dps if uid != user_id]
-            await self._persist_slots()
-            return
-
-        if len(self.dps) >= 3:
-            await interaction.response.send_message("Слот уже занят", ephemeral=True)
-            return
-
-        self._remove_user_from_all(user_id)
-        self.dps.append(user_id)
-        await self._persist_slots()
-
-    async def _persist_slots(self):
-        # Обновляем запись в БД, если message_id известен
-        try:
-            if self.message_id and hasattr(self.bot, 'db') and self.bot.db:
-                await self.bot.db.update_lfg_slots(self.message_id, self.tank, self.healer, self.dps)
-        except Exception:
-            logging.getLogger(__name__).exception("Failed to persist LFG slots")
-
-    async def update_buttons(self, interaction: discord.Interaction, embed: discord.Embed):
-        """Обновляет состояние кнопок (disabled) в зависимости от заполненности слотов.
-        Если группа полностью собрана (1 танк, 1 хил, 3 дд) — меняет цвет embed на зелёный,
-        блокирует кнопки записи и отправляет сообщение о собранной группе в канал (один раз).
-        """
-        # Определяем состояния
-        tank_taken = self.tank is not None
-        healer_taken = self.healer is not None
-        dps_count = len(self.dps)
-
-        # Обновляем disabled для кнопок
+    def update_buttons(self):
+        """Блокирует кнопки занятых ролей; у собранной группы (1 танк, 1 хил, 3 дд) заблокированы все."""
+        state = self.state
         for child in self.children:
-            if not isinstance(child, discord.ui.Button):
+            if not isinstance(child, LFGRoleButton):
                 continue
-            label = getattr(child, 'label', '')
-            if label == 'Танк':
-                child.disabled = tank_taken
-            elif label == 'Хил':
-                child.disabled = healer_taken
-            elif label == 'ДД':
-                child.disabled = (dps_count >= 3)
-
-        # Проверяем полное собрание
-        is_full = tank_taken and healer_taken and (dps_count >= 3)
-        if is_full:
-            # Изменяем цвет embed на зелёный
+            if child.role == "tank":
+                child.item.disabled = state.tank is not None
+            elif child.role == "healer":
+                child.item.disabled = state.healer is not None
+            elif child.role == "dps":
+                child.item.disabled = len(state.dps) >= DPS_SLOTS
+
+    @staticmethod
+    def _format_line(uid: int, rio: Optional[float], ilvl: Optional[int]) -> str:
+        parts = [f"<@{uid}>"]
+        if rio is not None:
+            parts.append(f"RIo: {int(rio) if isinstance(rio, (int, float)) else rio}")
+        if ilvl is not None:
+            parts.append(f"iLvl: {ilvl}")
+        return " — ".join(parts)
+
+    def _template(self) -> Optional[discord.Embed]:
+        if self.state.embed:
             try:
-                embed.color = discord.Color(0x00ff00)
+                return discord.Embed.from_dict(self.state.embed)
             except Exception:
                 pass
+        return self.embed_template.copy() if self.embed_template else None
 
-            # Если ещё не объявляли — отправляем сообщение в канал
-            if not self.full_announced:
-                tank_mention = f"<@{self.tank}>" if self.tank else ""
-                healer_mention = f"<@{self.healer}>" if self.healer else ""
-                dps_mentions = " ".join(f"<@{uid}>" for uid in self.dps)
-                try:
-                    if interaction.channel:
-                        await interaction.channel.send(f"Группа собрана! 🚀 {tank_mention} {healer_mention} {dps_mentions}")
-                except Exception:
-                    logging.getLogger(__name__).exception("Failed to send full party announcement")
-                self.full_announced = True
-        else:
-            # Если группа уже не полная — сбрасываем флаг, чтобы можно было объявить снова
-            self.full_announced = False
-
-    async def update_buttons(self, interaction: discord.Interaction, embed: discord.Embed):
-        """Обновляет состояние кнопок (disabled) в зависимости от заполненности слотов.
-        Если группа полностью собрана (1 танк, 1 хил, 3 дд) — меняет цвет embed на зелёный,
-        блокирует кнопки записи и отправляет сообщение о собранной группе в канал (один раз).
+    async def update_embed(self) -> discord.Embed:
+        """Embed для текущих слотов. Готовый embed кэшируется по состоянию слотов, строка участника —
+        по discord_id, поэтому статистика запрашивается только для новых участников сбора.
         """
-        # Определяем состояния
-        tank_taken = self.tank is not None
-        healer_taken = self.healer is not None
-        dps_count = len(self.dps)
-
-        # Обновляем disabled для кнопок
-        for child in self.children:
-            if not isinstance(child, discord.ui.Button):
-                continue
-            label = getattr(child, 'label', '')
-            if label == 'Танк':
-                child.disabled = tank_taken
-            elif label == 'Хил':
-                child.disabled = healer_taken
-            elif label == 'ДД':
-                child.disabled = (dps_count >= 3)
-
-        # Проверяем полное собрание
-        is_full = tank_taken and healer_taken and (dps_count >= 3)
-        if is_full:
-            # Изменяем цвет embed на зелёный
-            try:
-                embed.color = discord.Color(0x00ff00)
-            except Exception:
-                pass
+        state, post = self.state, self.post
+        key = state.slot_key()
+        cached = post.rendered.get(key)
+        if cached is not None:
+            return cached
+
+        newcomers = [uid for uid in dict.fromkeys(state.members) if uid not in post.lines]
+        if newcomers:
+            stats = await asyncio.gather(*(self._fetch_stats_for(uid) for uid in newcomers))
+            for uid, (rio, ilvl) in zip(newcomers, stats):
+                post.lines[uid] = self._format_line(uid, rio, ilvl)
 
-            # Если ещё не объявляли — отправляем сообщение в канал
-            if not self.full_announced:
-                tank_mention = f"<@{self.tank}>" if self.tank else ""
-                healer_mention = f"<@{self.healer}>" if self.healer else ""
-                dps_mentions = " ".join(f"<@{uid}>" for uid in self.dps)
-                try:
-                    if interaction.channel:
-                        await interaction.channel.send(f"Группа собрана! 🚀 {tank_mention} {healer_mention} {dps_mentions}")
-                except Exception:
-                    logging.getLogger(__name__).exception("Failed to send full party announcement")
-                self.full_announced = True
-        else:
-            # Если группа уже не полная — сбрасываем флаг, чтобы можно было объявить снова
-            self.full_announced = False
+        def fmt(uid: Optional[int]) -> str:
+            return post.lines.get(uid, f"<@{uid}>") if uid else "Пусто"
 
-    async def update_embed(self) -> discord.Embed:
         # Берем шаблонный embed, если он есть, иначе создаем новый
-        if self.embed_template:
-            new_embed = self.embed_template.copy()
-        else:
-            new_embed = discord.Embed(title="Сбор", color=discord.Color.gold())
+        new_embed = self._template() or discord.Embed(title="Сбор", color=discord.Color.gold())
+        # Собранная группа подсвечивается зелёным
+        if state.is_full:
+            new_embed.color = discord.Color(0x00ff00)
 
         # Очищаем поля и ставим актуальные
         new_embed.clear_fields()
-        # Сбор данных для всех участников параллельно
-        all_user_ids: List[int] = []
-        if self.tank:
-            all_user_ids.append(self.tank)
-        if self.healer:
-            all_user_ids.append(self.healer)
-        all_user_ids.extend(self.dps)
-
-        stats_tasks = {uid: asyncio.create_task(self._fetch_stats_for(uid)) for uid in set(all_user_ids)}
-        if stats_tasks:
-            await asyncio.gather(*stats_tasks.values())
-
-        def fmt(uid: Optional[int]) -> str:
-            if not uid:
-                return "Пусто"
-            rio, ilvl = (None, None)
-            task = stats_tasks.get(uid)
-            if task and task.done():
-                try:
-                    rio, ilvl = task.result()
-                except Exception:
-                    rio, ilvl = (None, None)
-
-            parts = [f"<@{uid}>"]
-            if rio is not None:
-                parts.append(f"RIo: {int(rio) if isinstance(rio, (int, float)) else rio}")
-            if ilvl is not None:
-                parts.append(f"iLvl: {ilvl}")
-            return " — ".join(parts)
-
-        tank_field = fmt(self.tank)
-        healer_field = fmt(self.healer)
-
-        if self.dps:
-            dps_lines = []
-            for uid in self.dps:
-                dps_lines.append(fmt(uid))
-            dps_field = "\n".join(dps_lines)
-        else:
-            dps_field = "Пусто"
-
-        new_embed.add_field(name=f"{ROLE_ICONS['Tank']} Танк", value=tank_field, inline=True)
-        new_embed.add_field(name=f"{ROLE_ICONS['Healer']} Лекарь", value=healer_field, inline=True)
+        dps_field = "\n".join(fmt(uid) for uid in state.dps) if state.dps else "Пусто"
+        new_embed.add_field(name=f"{ROLE_ICONS['Tank']} Танк", value=fmt(state.tank), inline=True)
+        new_embed.add_field(name=f"{ROLE_ICONS['Healer']} Лекарь", value=fmt(state.healer), inline=True)
         new_embed.add_field(name=f"{ROLE_ICONS['DPS']} Бойцы", value=dps_field, inline=True)
+        post.remember_render(key, new_embed)
         return new_embed
 
-    # Удалены декораторы @discord.ui.button и связанные методы, чтобы persistent view не содержала динамически созданных discord.ui.Button без custom_id.
-
 
 class Keys(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        # Восстанавливаем персистентные LFG view'ы после старта
-        try:
-            self.bot.loop.create_task(self._restore_views())
-        except Exception:
-            pass
 
-    async def _restore_views(self):
+    async def cog_load(self):
+        # Один обработчик на все сборы по шаблону custom_id: ничего не восстанавливаем при старте,
+        # состояние сбора подгружается из bot.lfg_store при первом клике
+        self.bot.add_dynamic_items(LFGRoleButton, LFGCloseButton)
+        # Обновлённая статистика участника перерисовывает его строку в открытых сборах
+        self.bot.member_stats.listeners.append(self._on_member_stats)
+        # Очистка общая для всей БД: в кластере её выполняет один процесс
+        if cluster.is_primary():
+            self.expire_lfgs.start()
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(LFGRoleButton, LFGCloseButton)
+        if self._on_member_stats in self.bot.member_stats.listeners:
+            self.bot.member_stats.listeners.remove(self._on_member_stats)
+        task = self.expire_lfgs.get_task()
+        self.expire_lfgs.cancel()
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _on_member_stats(self, user_id: int, char) -> None:
+        """Свежий снимок участника: строка в сборах заменяется, сообщения правятся через bot.lfg_edits."""
+        line = KeyView._format_line(user_id, *char.stats)
+        for post in self.bot.lfg_store.update_member_line(user_id, line):
+            channel = self.bot.get_partial_messageable(post.state.channel_id)
+            self.bot.lfg_edits.request(post.message_id, lambda p=post, c=channel: render_lfg_message(self.bot, p, c))
+
+    @tasks.loop(minutes=LFG_SWEEP_MINUTES)
+    async def expire_lfgs(self):
+        """Удаляет истёкшие сборы пачками и убирает их из памяти; сообщения помечаются как истёкшие."""
         await self.bot.wait_until_ready()
-        # Загрузим все активные LFG из базы и восстановим view'ы
+        removed = 0
         try:
-            rows = await self.bot.db.get_active_lfgs()
-            for row in rows:
-                message_id, channel_id, author_id, tank, healer, dps, embed_dict = row
-                # Попытка получить оригинальное сообщение, чтобы восстановить embed шаблон
-                embed = None
-                try:
-                    ch = self.bot.get_channel(channel_id)
-                    if ch:
-                        try:
-                            msg = await ch.fetch_message(message_id)
-                            embed = msg.embeds[0] if msg.embeds else None
-                        except Exception:
-                            embed = None
-                except Exception:
-                    embed = None
-
-                # Если не удалось получить embed из сообщения, попробуем восстановить из сохранённого JSON
-                if embed is None and embed_dict:
-                    try:
-                        embed = discord.Embed.from_dict(embed_dict)
-                    except Exception:
-                        embed = None
-
-                # При восстановлении регистрируем персистентную версию только с нашим LFG custom_id
-                persistent_view = KeyView(self.bot, author_id, embed, message_id=message_id, tank=tank, healer=healer, dps=dps)
-                # Оставляем только элементы с custom_id и начинающиеся с "lfg:"
-                persistent_view.children[:] = [
-                    c for c in persistent_view.children
-                    if isinstance(c, discord.ui.Button)
-                    and getattr(c, 'custom_id', None)
-                    and str(getattr(c, 'custom_id')).startswith('lfg:')
-                ]
-                try:
-                    try:
-                        self.bot.add_view(persistent_view, message_id=message_id)
-                    except Exception:
-                        await self.bot.add_view(persistent_view, message_id=message_id)  # type: ignore
-                except Exception:
-                    logging.getLogger(__name__).exception("Failed to restore view for message %s", message_id)
+            while True:
+                rows = await self.bot.db.get_expired_lfgs(time.time(), LFG_SWEEP_BATCH)
+                if not rows:
+                    break
+                for message_id, channel_id in rows:
+                    self.bot.lfg_store.discard(message_id)
+                    self.bot.lfg_edits.cancel(message_id)
+                    if LFG_MARK_EXPIRED:
+                        await self._mark_expired(message_id, channel_id)
+                await self.bot.db.delete_lfgs([message_id for message_id, _ in rows])
+                removed += len(rows)
+                LFG_POSTS.inc(len(rows), event="expired")
+                if len(rows) < LFG_SWEEP_BATCH:
+                    break
+        except Exception:
+            logging.getLogger(__name__).exception("Error while expiring LFG posts")
+        if removed:
+            logging.getLogger(__name__).info("⌛ Удалено истёкших сборов: %d", removed)
+
+    async def _mark_expired(self, message_id: int, channel_id: int):
+        # Без fetch_message и кэша каналов (канал может принадлежать шарду другого процесса):
+        # частичное сообщение, снимаем кнопки и дописываем пометку
+        channel = self.bot.get_partial_messageable(channel_id)
+        try:
+            await channel.get_partial_message(message_id).edit(content="⌛ Сбор истёк", view=None)
+        except discord.NotFound:
+            pass
         except Exception:
-            logging.getLogger(__name__).exception("Error restoring LFG views on startup")
+            logging.getLogger(__name__).debug("Failed to mark LFG %s as expired", message_id, exc_info=True)
 
     async def dungeon_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
         # DUNGEONS — словарь: ключ — английское, значение — русское
@@ -540,38 +366,28 @@ class Keys(commands.Cog):
         msg = await interaction.original_response()
 
         # Сохраняем LFG в БД
+        embed_dict = embed.to_dict()
+        embed_json = None
         try:
-            try:
-                embed_json = None
-                try:
-                    embed_json = json.dumps(embed.to_dict())
-                except Exception:
-                    embed_json = None
-                await self.bot.db.save_lfg(msg.id, interaction.channel.id, interaction.user.id, None, None, [], embed_json)
-            except Exception:
-                # fallback: save without embed
-                await self.bot.db.save_lfg(msg.id, interaction.channel.id, interaction.user.id, None, None, [], None)
+            embed_json = jsoncodec.dumps(embed_dict)
         except Exception:
-            logging.getLogger(__name__).exception("Failed to save LFG to DB")
-
-        # Создаем view с message_id и прикрепляем её к сообщению для немедленного взаимодействия
-        view = KeyView(interaction.client, interaction.user.id, embed, message_id=msg.id)
+            embed_json = None
         try:
-            await msg.edit(view=view)
+            await self.bot.db.save_lfg(msg.id, interaction.channel.id, interaction.user.id, None, None, [], embed_json)
         except Exception:
-            # если не удалось прикрепить сразу — не критично
-            logging.getLogger(__name__).debug("Не удалось прикрепить view к сообщению сразу")
+            logging.getLogger(__name__).exception("Failed to save LFG to DB")
+
+        LFG_POSTS.inc(event="created")
+        post = self.bot.lfg_store.add(LFGState(msg.id, interaction.channel.id, interaction.user.id, embed=embed_dict))
 
-        # Регистрируем персистентную view — оставляем только наши LFG custom_id элементы
-        persistent_view = KeyView(interaction.client, interaction.user.id, embed, message_id=msg.id, tank=view.tank, healer=view.healer, dps=view.dps)
-        persistent_view.children[:] = [c for c in persistent_view.children if getattr(c, 'custom_id', None) and str(getattr(c, 'custom_id')).startswith('lfg:')]
+        # Прикрепляем кнопки с message_id в custom_id; клики обрабатывают LFGRoleButton/LFGCloseButton
+        view = KeyView(interaction.client, post, embed)
         try:
-            try:
-                self.bot.add_view(persistent_view, message_id=msg.id)
-            except Exception:
-                await self.bot.add_view(persistent_view, message_id=msg.id)  # type: ignore
+            await msg.edit(view=view)
         except Exception:
-            logging.getLogger(__name__).exception("Failed to add persistent view")
+            logging.getLogger(__name__).exception("Failed to attach LFG buttons")
+        finally:
+            view.stop()
 
 async def setup(bot):
     await bot.add_cog(Keys(bot))
\ No newline at end of file
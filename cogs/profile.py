@@ -2,17 +2,36 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import aiohttp
-from utils.database import Database
-from utils.raiderio import get_character_data
+from utils.raiderio import DEFAULT_REFRESH_RPS, RAIDEROIO_CONCURRENCY, get_character_data
+from utils.workers import run_worker_pool
+from utils import cluster, memory, metrics, tracing
 from discord.ext import tasks
 import asyncio
 import logging
-from utils.cache import cache
+import os
+import time
+from utils.snapshots import format_age
+from utils.models import CharacterSnapshot
 from typing import Optional
 
 # Логгер модуля
 logger = logging.getLogger(__name__)
 
+# Параметры фонового обновления: число воркеров (по умолчанию — весь бюджет семафора Raider.IO)
+# и целевая скорость запросов в секунду для одного прохода. Общий потолок задаёт RAIDERIO_RPS
+# в utils/raiderio.py; REFRESH_RPS ниже него оставляет запас для интерактивных команд.
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", RAIDEROIO_CONCURRENCY))
+REFRESH_RPS = float(os.getenv("REFRESH_RPS", DEFAULT_REFRESH_RPS))
+# Сколько обновлённых персонажей копить перед одной транзакцией записи
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", "200"))
+# bot_meta: гильдии (через запятую), для которых полная привязка участников в LOW_MEMORY уже выполнена
+MEMBERS_BACKFILL_KEY = "members_backfill_guilds"
+
+REFRESH_USERS = metrics.counter("refresh_users_total", "Пользователи в проходах background_update по результату", ["result"])
+REFRESH_CHANGED = metrics.counter("refresh_rows_changed_total", "Строки users, реально изменённые проходами background_update")
+REFRESH_DURATION = metrics.gauge("refresh_pass_duration_seconds", "Длительность последнего прохода background_update")
+REFRESH_LAST_SUCCESS = metrics.gauge("refresh_pass_last_success_timestamp", "Время окончания последнего прохода background_update (unix)")
+
 # Словарь популярных RU/EU серверов
 REALMS = {
     "Гордунни": "gordunni",
@@ -53,13 +72,152 @@ CLASS_COLORS = {
     "Shaman": 0x0070DE, "Warlock": 0x8788EE, "Warrior": 0xC69B6D
 }
 
+TOP_PAGE_SIZE = 10
+
+
+class TopView(discord.ui.View):
+    """Пагинация /top по рейтингу гильдии из памяти (bot.leaderboards), без запросов к SQLite."""
+
+    def __init__(self, cog: "Profile", guild_id: int, page: int = 0):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.guild_id = guild_id
+        self.page = page
+        # Сообщение с топом: по таймауту в нём выключаются кнопки
+        self.message: Optional[discord.Message] = None
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            # Сообщение удалено или недоступно — кнопки и так не нажать
+            pass
+
+    def build_embed(self, viewer_id: int) -> discord.Embed:
+        board = self.cog.bot.leaderboards.board(self.guild_id)
+        pages = board.page_count(TOP_PAGE_SIZE)
+        self.page = max(0, min(self.page, pages - 1))
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        return self.cog.create_top_embed(self.guild_id, self.page, viewer_id)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    @tracing.traced("top:page")
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.build_embed(interaction.user.id), view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    @tracing.traced("top:page")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.build_embed(interaction.user.id), view=self)
+
+
 class Profile(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._members_synced = False
+        # Обновлённые персонажи текущего прохода background_update, ждущие пакетной записи
+        self._refresh_batch: list[tuple[CharacterSnapshot, tuple]] = []
+        self._refresh_changed = 0
         self.background_update.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
+        # Дожидаемся остановки прохода: его finally дописывает накопленный пакет, пока БД открыта
+        task = self.background_update.get_task()
         self.background_update.cancel()
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _track_guild_member(self, interaction: discord.Interaction) -> None:
+        """Привязывает зарегистрированного пользователя к гильдии, в которой он вызвал команду."""
+        guild = interaction.guild
+        user_id = interaction.user.id
+        leaderboards = self.bot.leaderboards
+        if guild is None or leaderboards.is_member(guild.id, user_id) or leaderboards.character(user_id) is None:
+            return
+        try:
+            await self.bot.db.add_guild_members([(guild.id, user_id)])
+            leaderboards.add_member(guild.id, user_id)
+        except Exception:
+            logger.exception(f"Не удалось привязать пользователя {user_id} к гильдии {guild.id}")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Один раз после старта привязываем к гильдиям уже зарегистрированных пользователей из кэша участников
+        if self._members_synced:
+            return
+        self._members_synced = True
+        leaderboards = self.bot.leaderboards
+        try:
+            users = await self.bot.db.get_all_users()
+            backfilled = None
+            if memory.LOW_MEMORY:
+                # Кэша участников нет — спрашиваем у шлюза только зарегистрированных
+                pairs, backfilled = await self._query_memberships(users)
+            else:
+                pairs = [
+                    (guild.id, user.discord_id)
+                    for guild in self.bot.guilds
+                    for user in users
+                    if not leaderboards.is_member(guild.id, user.discord_id) and guild.get_member(user.discord_id)
+                ]
+            await self.bot.db.add_guild_members(pairs)
+            for guild_id, discord_id in pairs:
+                leaderboards.add_member(guild_id, discord_id)
+            if backfilled is not None:
+                await self.bot.db.set_meta(MEMBERS_BACKFILL_KEY, ",".join(str(g) for g in sorted(backfilled)))
+            if pairs:
+                logger.info(f"🏆 Привязано к гильдиям пользователей: {len(pairs)}")
+        except Exception:
+            logger.exception("Ошибка синхронизации участников гильдий")
+
+    async def _query_memberships(self, users: list[CharacterSnapshot]) -> tuple[list[tuple[int, int]], set[int]]:
+        """Пары (guild_id, discord_id) зарегистрированных пользователей без кэша участников: запросы по 100 ID.
+
+        Полный проход по гильдии делается один раз (отметка в bot_meta); дальше в ней ищутся только
+        пользователи без единой привязки — остальные привязываются при вызове команд (_track_guild_member).
+        Возвращает пары и обновлённое множество гильдий с выполненной полной привязкой.
+        """
+        leaderboards = self.bot.leaderboards
+        stored = await self.bot.db.get_meta(MEMBERS_BACKFILL_KEY)
+        backfilled = {int(g) for g in stored.split(",") if g} if stored else set()
+        unbound = [u.discord_id for u in users if not leaderboards.has_guilds(u.discord_id)]
+        pairs: list[tuple[int, int]] = []
+        for guild in self.bot.guilds:
+            if guild.id in backfilled:
+                ids = unbound
+            else:
+                ids = [u.discord_id for u in users if not leaderboards.is_member(guild.id, u.discord_id)]
+            complete = True
+            for i in range(0, len(ids), 100):
+                try:
+                    members = await guild.query_members(user_ids=ids[i:i + 100], cache=False)
+                except Exception:
+                    logger.warning(f"Не удалось запросить участников гильдии {guild.id}", exc_info=True)
+                    complete = False
+                    break
+                pairs.extend((guild.id, m.id) for m in members)
+            if complete:
+                backfilled.add(guild.id)
+        return pairs, backfilled
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        # raw-событие приходит и без кэша участников (LOW_MEMORY)
+        guild_id, user_id = payload.guild_id, payload.user.id
+        if not self.bot.leaderboards.is_member(guild_id, user_id):
+            return
+        self.bot.leaderboards.remove_member(guild_id, user_id)
+        try:
+            await self.bot.db.remove_guild_member(guild_id, user_id)
+        except Exception:
+            logger.exception(f"Не удалось отвязать пользователя {user_id} от гильдии {guild_id}")
 
     # Функция автодополнения для параметра realm
     async def realm_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
@@ -90,65 +248,48 @@ class Profile(commands.Cog):
         region_slug = region.value
         realm_slug = realm
 
-        # Проверяем у Raider.IO наличие персонажа
-        data = await get_character_data(name, realm_slug, region_slug)
-        if not data:
+        # Проверяем у Raider.IO наличие персонажа (живой запрос, снимок сохраняется)
+        char = await self.bot.snapshots.fetch(name, realm_slug, region_slug, "score")
+        if not char:
             await interaction.response.send_message(
                 f"Ошибка: не удалось найти персонажа '{name}' на сервере '{realm}' ({region.name}). Проверьте корректность данных.",
                 ephemeral=True,
             )
             return
 
-        # Разбор данных
-        try:
-            rio_score = data["mythic_plus_scores_by_season"][0]["scores"]["all"]
-        except Exception:
-            rio_score = 0
-
-        thumbnail_url = data.get("thumbnail_url")
-        main_class = data.get("class")
-        item_level = data.get('gear', {}).get('item_level_equipped')
-
         # Сохраняем в БД
-        await Database().register_user(
-            interaction.user.id, name, realm_slug, region_slug, rio_score, main_class, thumbnail_url, item_level
-        )
+        char = char.for_user(interaction.user.id)
+        await self.bot.db.save_character(char)
 
         # Обновляем кэш для быстрого отображения
-        try:
-            await cache.set(interaction.user.id, (rio_score, item_level))
-        except Exception:
-            logger.debug("Не удалось записать кэш после регистрации")
+        self.bot.member_stats.prime(interaction.user.id, char)
+        await self._track_guild_member(interaction)
 
         embed = discord.Embed(title="Регистрация успешна!", color=discord.Color.green())
-        embed.add_field(name="Персонаж", value=f"{name} ({realm}, {region.name})", inline=False)
-        embed.add_field(name="Рейтинг", value=f"{rio_score}", inline=True)
-        if thumbnail_url:
-            embed.set_thumbnail(url=thumbnail_url)
+        embed.add_field(name="Персонаж", value=f"{char.name} ({realm}, {region.name})", inline=False)
+        embed.add_field(name="Рейтинг", value=f"{char.rio_score}", inline=True)
+        if char.thumbnail_url:
+            embed.set_thumbnail(url=char.thumbnail_url)
 
         await interaction.response.send_message(embed=embed)
 
     @app_commands.command(name="me", description="Показать информацию о вашем профиле")
     async def profile(self, interaction: discord.Interaction):
         # Получение данных пользователя из базы
-        user_data = await Database().get_user(interaction.user.id)
-
-        if user_data:
-            # Database schema may include optional `item_level` as the 8th column.
-            # Unpack defensively to avoid ValueError if schema changed.
-            discord_id, character_name, realm_slug, region, rio_score, char_class, thumbnail, *rest = user_data
-            item_level = rest[0] if rest else None
+        user = await self.bot.db.get_user(interaction.user.id)
 
-            # Запрос к Raider.IO API
+        if user:
+            await self._track_guild_member(interaction)
+            # Снимок Raider.IO (устаревший обновится в фоне) или живой запрос
             try:
-                data = await get_character_data(character_name, realm_slug, region)
-                if not data:
+                char, age = await self.bot.snapshots.get(user.name, user.realm, user.region, "profile")
+                if not char:
                     await interaction.response.send_message(
                         "Персонаж не найден на Raider.IO. Проверьте данные.", ephemeral=True
                     )
                     return
 
-                embed = self.create_character_embed(data)
+                embed = self.create_character_embed(char, age)
                 await interaction.response.send_message(embed=embed)
 
             except Exception as e:
@@ -169,15 +310,15 @@ class Profile(commands.Cog):
         await interaction.response.defer()
 
         try:
-            data = await get_character_data(name, realm, region.value)
-            if data is None:
+            char, age = await self.bot.snapshots.get(name, realm, region.value, "profile")
+            if char is None:
                 await interaction.followup.send(
                     f"❌ Персонаж **{name}** ({realm}) не найден. Проверьте правильность ника и сервера.",
                     ephemeral=True
                 )
                 return
 
-            embed = self.create_character_embed(data)
+            embed = self.create_character_embed(char, age)
             await interaction.followup.send(embed=embed)
 
         except Exception as e:
@@ -187,33 +328,48 @@ class Profile(commands.Cog):
 
     @app_commands.command(name="top", description="Показать топ игроков сервера")
     async def top(self, interaction: discord.Interaction):
-        await interaction.response.defer()
+        if interaction.guild is None:
+            await interaction.response.send_message("Команда работает только на сервере.", ephemeral=True)
+            return
 
+        await self._track_guild_member(interaction)
         try:
-            top_users = await Database().get_top_users(10)
-            if not top_users:
-                await interaction.followup.send("Топ игроков пуст. Зарегистрируйтесь через /register!", ephemeral=True)
+            if not len(self.bot.leaderboards.board(interaction.guild.id)):
+                await interaction.response.send_message("Топ игроков пуст. Зарегистрируйтесь через /register!", ephemeral=True)
                 return
 
-            embed = discord.Embed(title="🏆 Топ игроков сервера", color=discord.Color.gold())
-
-            medals = ["🥇", "🥈", "🥉"]
-            for idx, user in enumerate(top_users):
-                name, realm, score, char_class = user
-                medal = medals[idx] if idx < len(medals) else f"{idx + 1}."
-                embed.add_field(
-                    name=f"{medal} {char_class} {name}",
-                    value=f"Сервер: {realm}, Рейтинг: {score}",
-                    inline=False
-                )
-
-            await interaction.followup.send(embed=embed)
+            view = TopView(self, interaction.guild.id)
+            await interaction.response.send_message(embed=view.build_embed(interaction.user.id), view=view)
+            view.message = await interaction.original_response()
 
         except Exception as e:
-            await interaction.followup.send(
+            logger.exception("Ошибка при построении топа")
+            await interaction.response.send_message(
                 f"Произошла ошибка при получении топа: {e}", ephemeral=True
             )
 
+    def create_top_embed(self, guild_id: int, page: int, viewer_id: int) -> discord.Embed:
+        leaderboards = self.bot.leaderboards
+        board = leaderboards.board(guild_id)
+        embed = discord.Embed(title="🏆 Топ игроков сервера", color=discord.Color.gold())
+
+        medals = ["🥇", "🥈", "🥉"]
+        for rank, discord_id, score in board.page(page, TOP_PAGE_SIZE):
+            name, realm, char_class = leaderboards.character(discord_id) or ("?", "?", None)
+            medal = medals[rank - 1] if rank <= len(medals) else f"{rank}."
+            embed.add_field(
+                name=f"{medal} {char_class or ''} {name}",
+                value=f"Сервер: {realm}, Рейтинг: {score}",
+                inline=False
+            )
+
+        viewer_rank = board.rank(viewer_id)
+        footer = f"Страница {page + 1}/{board.page_count(TOP_PAGE_SIZE)}"
+        if viewer_rank is not None:
+            footer += f" • Ваше место: {viewer_rank} из {len(board)}"
+        embed.set_footer(text=footer)
+        return embed
+
     def get_score_emoji(self, score: float) -> str:
         if score < 1500:
             return "🟢"  # Зеленый / Необычный
@@ -224,35 +380,34 @@ class Profile(commands.Cog):
         else:
             return "🟠"  # Оранжевый / Легендарный
 
-    def create_character_embed(self, data) -> discord.Embed:
-        rio_score = data["mythic_plus_scores_by_season"][0]["scores"]["all"]
-        item_level = data.get("gear", {}).get("item_level_equipped", 0)
-        guild_name = data.get("guild", {}).get("name", "Без гильдии")
-        thumbnail_url = data["thumbnail_url"]
-        profile_url = data["profile_url"]
+    def create_character_embed(self, char: CharacterSnapshot, age: Optional[float] = None) -> discord.Embed:
+        rio_score = char.rio_score
+        item_level = char.item_level or 0
+        guild_name = char.guild_name or "Без гильдии"
 
         # Формирование списка лучших забегов
-        best_runs = data.get("mythic_plus_best_runs", [])
-        best_runs = sorted(best_runs, key=lambda x: x["score"], reverse=True)[:5]
+        best_runs = sorted(char.best_runs, key=lambda run: run.score, reverse=True)[:5]
         best_runs_text = []
         for run in best_runs:
-            dungeon_name = DUNGEON_RU.get(run["dungeon"], run["dungeon"])
-            level = run["mythic_level"]
-            upgrades = "⭐" * run["num_keystone_upgrades"]
-            best_runs_text.append(f"+{level} {dungeon_name} ({upgrades})")
+            dungeon_name = DUNGEON_RU.get(run.dungeon, run.dungeon)
+            upgrades = "⭐" * run.num_keystone_upgrades
+            best_runs_text.append(f"+{run.mythic_level} {dungeon_name} ({upgrades})")
 
         best_runs_field = "\n".join(best_runs_text) if best_runs_text else "Нет данных о забегах."
 
         emoji = self.get_score_emoji(rio_score)
         embed = discord.Embed(
-            title=f"{data['name']} ({data['class']}) - {guild_name}",
-            color=CLASS_COLORS.get(data['class'], 0x808080),
-            description=f"[Профиль на Raider.IO]({profile_url})"
+            title=f"{char.name} ({char.char_class}) - {guild_name}",
+            color=CLASS_COLORS.get(char.char_class, 0x808080),
+            description=f"[Профиль на Raider.IO]({char.profile_url})"
         )
-        embed.set_thumbnail(url=thumbnail_url)
+        if char.thumbnail_url:
+            embed.set_thumbnail(url=char.thumbnail_url)
         embed.add_field(name="Raider.IO Score", value=f"{emoji} **{rio_score}**", inline=True)
         embed.add_field(name="Item Level", value=f"{item_level}", inline=True)
         embed.add_field(name="🏆 Лучшие забеги", value=best_runs_field, inline=False)
+        if age is not None:
+            embed.set_footer(text=f"Данные Raider.IO: {format_age(age)}")
 
         return embed
 
@@ -261,39 +416,31 @@ class Profile(commands.Cog):
         await interaction.response.defer()
 
         try:
-            user_data = await Database().get_user(interaction.user.id)
-            if not user_data:
+            user = await self.bot.db.get_user(interaction.user.id)
+            if not user:
                 await interaction.followup.send("Вы не зарегистрированы. Используйте команду `/register`, чтобы зарегистрироваться.", ephemeral=True)
                 return
 
-            discord_id, character_name, realm_slug, region, old_score, char_class, thumbnail, *rest = user_data
-            old_item_level = rest[0] if rest else None
+            old_score = user.rio_score
 
-            # Запрос к Raider.IO API
-            data = await get_character_data(character_name, realm_slug, region)
-            if not data:
+            # Живой запрос к Raider.IO API (снимок сохраняется)
+            char = await self.bot.snapshots.fetch(user.name, user.realm, user.region, "score")
+            if not char:
                 await interaction.followup.send(
                     "❌ Не удалось получить данные с Raider.IO. Проверьте настройки персонажа или попробуйте позже.",
                     ephemeral=True
                 )
                 return
 
-            new_score = data["mythic_plus_scores_by_season"][0]["scores"]["all"]
-            new_thumbnail = data["thumbnail_url"]
-            new_class = data["class"]
+            new_score = char.rio_score
 
             # Обновление данных в базе
-            new_item_level = data.get('gear', {}).get('item_level_equipped')
-            await Database().register_user(
-                interaction.user.id, character_name, realm_slug, region, new_score, new_class, new_thumbnail, new_item_level
-            )
+            char = char.for_user(interaction.user.id)
+            await self.bot.db.save_character(char)
 
             # Обновить кэш после ручного обновления
-            try:
-                new_item_level = data.get('gear', {}).get('item_level_equipped')
-                await cache.set(interaction.user.id, (new_score, new_item_level))
-            except Exception:
-                logger.debug("Не удалось записать кэш после /update")
+            self.bot.member_stats.prime(interaction.user.id, char)
+            await self._track_guild_member(interaction)
 
             embed = discord.Embed(title="✅ Профиль обновлен!", color=discord.Color.green())
             embed.add_field(name="Рейтинг", value=f"{old_score} ➡️ {new_score}", inline=False)
@@ -337,25 +484,25 @@ class Profile(commands.Cog):
                 target_realm = realm
                 target_region = region.value
             else:
-                user_data = await self.bot.db.get_user(interaction.user.id)
-                if not user_data:
+                user = await self.bot.db.get_user(interaction.user.id)
+                if not user:
                     await interaction.followup.send(
                         "Вы не зарегистрированы. Используйте команду `/register`, чтобы зарегистрироваться.",
                         ephemeral=True,
                     )
                     return
 
-                _, target_name, target_realm, target_region, *_ = user_data
+                target_name, target_realm, target_region = user.name, user.realm, user.region
 
-            data = await get_character_data(target_name, target_realm, target_region)
-            if not data:
+            char, age = await self.bot.snapshots.get(target_name, target_realm, target_region, "weekly")
+            if not char:
                 await interaction.followup.send(
                     f"❌ Персонаж **{target_name}** на сервере **{target_realm}** не найден.",
                     ephemeral=True,
                 )
                 return
 
-            weekly_runs = data.get("mythic_plus_weekly_highest_level_runs", [])
+            weekly_runs = char.weekly_runs
 
             embed = discord.Embed(
                 title=f"🎁 Недельный прогресс для {target_name}",
@@ -364,15 +511,15 @@ class Profile(commands.Cog):
 
             if not weekly_runs:
                 embed.description = "На этой неделе ключи еще не закрыты."
+                embed.set_footer(text=f"Данные Raider.IO: {format_age(age)}")
             else:
                 runs_text = []
                 for i, run in enumerate(weekly_runs[:8], start=1):
-                    dungeon_name = DUNGEON_RU.get(run["dungeon"], run["dungeon"])
-                    level = run["mythic_level"]
-                    runs_text.append(f"{i}. +{level} {dungeon_name}")
+                    dungeon_name = DUNGEON_RU.get(run.dungeon, run.dungeon)
+                    runs_text.append(f"{i}. +{run.mythic_level} {dungeon_name}")
 
                 embed.description = "\n".join(runs_text)
-                embed.set_footer(text=f"Закрыто ключей: {len(weekly_runs)}/8")
+                embed.set_footer(text=f"Закрыто ключей: {len(weekly_runs)}/8 • Данные Raider.IO: {format_age(age)}")
 
             await interaction.followup.send(embed=embed)
 
@@ -387,36 +534,66 @@ class Profile(commands.Cog):
         logger.info("🔄 Запуск фоновой задачи обновления...")
         try:
             users = await self.bot.db.get_all_users()
+            if cluster.CLUSTER_COUNT > 1:
+                # Каждый процесс кластера обновляет только своих пользователей
+                users = [u for u in users if cluster.owns_user(u.discord_id)]
             logger.info(f"📊 Найдено пользователей в базе: {len(users)}")
-            for user in users:
-                discord_id, character_name, realm_slug, region = user
-                try:
-                    data = await get_character_data(character_name, realm_slug, region)
-                    if not data:
-                        logger.warning(f"⚠️ Ошибка обновления для {character_name} ({realm_slug}). Пропуск.")
-                        continue
-
-                    new_score = data["mythic_plus_scores_by_season"][0]["scores"]["all"]
-                    new_thumbnail = data["thumbnail_url"]
-                    new_class = data["class"]
-
-                    await self.bot.db.register_user(
-                        discord_id, character_name, realm_slug, region, new_score, new_class, new_thumbnail, data.get('gear', {}).get('item_level_equipped')
-                    )
-
-                    # Обновляем кэш, если пользователь есть в кэше
-                    try:
-                        new_item_level = data.get('gear', {}).get('item_level_equipped')
-                        await cache.set(discord_id, (new_score, new_item_level))
-                    except Exception:
-                        logger.debug(f"Не удалось записать кэш для {character_name}")
-
-                    await asyncio.sleep(2)  # Задержка для предотвращения спама API
-                except Exception as e:
-                    logger.exception(f"Ошибка при обновлении пользователя {character_name}: {e}")
-            logger.info(f"🏁 Фоновое обновление завершено. Обработано {len(users)} пользователей.")
+            self._refresh_changed = 0
+            try:
+                report = await run_worker_pool(
+                    users,
+                    self._refresh_user,
+                    workers=REFRESH_WORKERS,
+                    rate=REFRESH_RPS,
+                    name="Фоновое обновление",
+                )
+            finally:
+                await self._flush_refresh_batch()
+            logger.info(f"🏁 {report}, изменено в БД: {self._refresh_changed}")
+            REFRESH_USERS.inc(report.processed, result="processed")
+            REFRESH_USERS.inc(report.failed, result="failed")
+            REFRESH_USERS.inc(report.skipped, result="skipped")
+            REFRESH_CHANGED.inc(self._refresh_changed)
+            REFRESH_DURATION.set(report.duration)
+            REFRESH_LAST_SUCCESS.set(time.time())
         except Exception as e:
             logger.exception(f"Ошибка при выполнении фоновой задачи: {e}")
 
+    async def _refresh_user(self, user: CharacterSnapshot) -> bool:
+        """Обновляет одного пользователя в рамках прохода background_update. False — пропуск.
+
+        Запрос идёт напрямую в Raider.IO (мимо LRU снимков), снимок пишется вместе с пакетом users.
+        """
+        data = await get_character_data(user.name, user.realm, user.region, "score")
+        if not data:
+            logger.warning(f"⚠️ Ошибка обновления для {user.name} ({user.realm}). Пропуск.")
+            return False
+
+        char = CharacterSnapshot.from_raiderio(data, user.realm, user.region, discord_id=user.discord_id)
+        row = self.bot.snapshots.snapshot_row(user.name, user.realm, user.region, char, "score")
+        self._refresh_batch.append((char, row))
+        if len(self._refresh_batch) >= REFRESH_BATCH_SIZE:
+            await self._flush_refresh_batch()
+
+        # Обновляем кэш статистики участников LFG
+        self.bot.member_stats.prime(user.discord_id, char)
+        return True
+
+    async def _flush_refresh_batch(self):
+        """Пишет накопленных персонажей и их снимки одной транзакцией; неизменившиеся строки users пропускаются.
+
+        При ошибке пакет возвращается в очередь (уйдёт со следующим сбросом), исключение не пробрасывается.
+        """
+        batch, self._refresh_batch = self._refresh_batch, []
+        if not batch:
+            return
+        try:
+            self._refresh_changed += await self.bot.db.upsert_characters(
+                [char for char, _ in batch], [row for _, row in batch]
+            )
+        except Exception:
+            logger.exception(f"Не удалось записать пакет фонового обновления ({len(batch)} персонажей), повторим со следующим сбросом")
+            self._refresh_batch = batch + self._refresh_batch
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(Profile(bot))
\ No newline at end of file
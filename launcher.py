@@ -0,0 +1,132 @@
+"""Запуск KeyMasterBot кластером: N процессов main.py, у каждого свой диапазон шардов.
+
+Примеры:
+  python launcher.py --clusters 4              # число шардов — рекомендованное Discord
+  python launcher.py --clusters 2 --shards 8
+
+Каждый процесс получает AUTO_SHARD=1, SHARD_COUNT, SHARD_IDS, CLUSTER_ID и CLUSTER_COUNT
+(см. utils/cluster.py), а лимиты Raider.IO (RAIDERIO_RPS, REFRESH_RPS) — поделёнными на число процессов.
+Все процессы работают с одной SQLite-базой (WAL, busy_timeout); фоновое обновление профилей
+делится по discord_id, общие задачи выполняет кластер 0.
+Упавший процесс перезапускается с нарастающей задержкой.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+from pathlib import Path
+
+import aiohttp
+from dotenv import load_dotenv
+
+from utils.cluster import shard_ranges
+from utils.raiderio import DEFAULT_RAIDERIO_RPS, DEFAULT_REFRESH_RPS
+from utils.logger import setup_logger
+
+MAIN = Path(__file__).resolve().parent / "main.py"
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Сколько ждать корректного завершения процесса перед kill (сек)
+STOP_TIMEOUT = 30
+# Лимиты запросов к Raider.IO задаются на весь бот: у каждого процесса свой token bucket,
+# поэтому процесс получает свою долю
+SHARED_RATES = {"RAIDERIO_RPS": DEFAULT_RAIDERIO_RPS, "REFRESH_RPS": DEFAULT_REFRESH_RPS}
+
+logger = logging.getLogger("launcher")
+
+
+async def recommended_shards(token: str) -> int:
+    """Рекомендованное Discord число шардов для бота."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+            return int(data["shards"])
+
+
+async def run_cluster(cluster_id: int, cluster_count: int, shard_ids: list[int], shard_count: int, stop: asyncio.Event):
+    env = dict(
+        os.environ,
+        AUTO_SHARD="1",
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=",".join(map(str, shard_ids)),
+        CLUSTER_ID=str(cluster_id),
+        CLUSTER_COUNT=str(cluster_count),
+    )
+    for name, default in SHARED_RATES.items():
+        env[name] = f"{float(os.getenv(name, default)) / cluster_count:g}"
+    loop = asyncio.get_running_loop()
+    backoff = 1.0
+    while not stop.is_set():
+        logger.info(f"▶️ Кластер {cluster_id}: шарды {shard_ids[0]}-{shard_ids[-1]} из {shard_count}")
+        proc = await asyncio.create_subprocess_exec(sys.executable, str(MAIN), env=env)
+        started = loop.time()
+        waiter = asyncio.create_task(proc.wait())
+        stopper = asyncio.create_task(stop.wait())
+        await asyncio.wait({waiter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+
+        if not waiter.done():
+            # Остановка лаунчера: просим процесс завершиться сам (закрыть БД, сбросить очереди)
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(waiter, STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Кластер {cluster_id} не завершился за {STOP_TIMEOUT} с — kill")
+                proc.kill()
+                await waiter
+            return
+        stopper.cancel()
+
+        code = proc.returncode
+        if code == 0:
+            logger.info(f"⏹️ Кластер {cluster_id} завершился")
+            return
+        # Процесс проработал долго — считаем падение разовым и сбрасываем задержку
+        if loop.time() - started > 60:
+            backoff = 1.0
+        logger.error(f"❌ Кластер {cluster_id} упал с кодом {code}, перезапуск через {backoff:.0f} с")
+        try:
+            await asyncio.wait_for(stop.wait(), backoff)
+        except asyncio.TimeoutError:
+            pass
+        backoff = min(backoff * 2, 60)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Запуск KeyMasterBot несколькими процессами")
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("--shards", type=int, default=None, help="общее число шардов (по умолчанию — рекомендованное Discord)")
+    args = parser.parse_args()
+
+    shard_count = args.shards
+    if not shard_count:
+        token = os.getenv("DISCORD_TOKEN")
+        if not token:
+            raise RuntimeError("DISCORD_TOKEN не задан")
+        shard_count = await recommended_shards(token)
+    ranges = shard_ranges(shard_count, args.clusters)
+    logger.info(f"🚀 Шардов: {shard_count}, процессов: {len(ranges)}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    await asyncio.gather(*(
+        run_cluster(cluster_id, len(ranges), shard_ids, shard_count, stop)
+        for cluster_id, shard_ids in enumerate(ranges)
+    ))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    setup_logger()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Завершение работы по запросу пользователя (KeyboardInterrupt)")
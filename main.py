@@ -5,12 +5,30 @@ import os
 import asyncio
 import logging
 from pathlib import Path
+
+# Загрузка переменных окружения из .env — до импорта utils: их настройки читаются при импорте
+load_dotenv()
+
+from utils import memory
+if memory.TRACEMALLOC:
+    # Как можно раньше, чтобы /memory видел выделения всех подсистем
+    memory.start_tracing()
+
 from utils.database import Database
+from utils import raiderio
+from utils.cache import cache
+from utils.snapshots import SnapshotCache
+from utils.refresh import RefreshManager
+from utils.leaderboard import GuildLeaderboards
+from utils.writebehind import WriteBehindQueue
+from utils.lfg import LFG_EDIT_WINDOW, LFGStore
+from utils.debounce import EditDebouncer
 from utils.logger import setup_logger
-from typing import cast
+from utils import cluster, metrics, tracing
+from utils.commandsync import sync_if_changed
+from utils.startup import StartupProfile
+from typing import Optional, cast
 
-# Загрузка переменных окружения из .env
-load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
 # Настройка логирования
@@ -25,38 +43,119 @@ if not TOKEN:
 # Приводим тип для статического анализатора: теперь TOKEN точно string
 TOKEN = cast(str, TOKEN)
 
-class KeyMasterBot(commands.Bot):
+# AUTO_SHARD=1 — AutoShardedBot (один процесс на несколько шардов); launcher.py запускает
+# несколько таких процессов, каждому — свой диапазон шардов (см. utils/cluster.py)
+BotBase = commands.AutoShardedBot if cluster.AUTO_SHARD else commands.Bot
+# Как часто процесс кластера подтягивает из БД рейтинги, обновлённые другими процессами (сек)
+LEADERBOARD_SYNC_INTERVAL = int(os.getenv("LEADERBOARD_SYNC_INTERVAL", "120"))
+# HTTP /metrics (Prometheus) на локальном интерфейсе; 0 — выключено. В кластере порт сдвигается на CLUSTER_ID
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Режим разработки: слэш-команды синхронизируются в эту гильдию (мгновенно), а не глобально
+DEV_GUILD_ID = int(os.getenv("DEV_GUILD_ID")) if os.getenv("DEV_GUILD_ID") else None
+# Синхронизировать команды даже при совпадении хэша дерева
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+
+
+class TracedCommandTree(discord.app_commands.CommandTree):
+    """Дерево команд, открывающее трассу для каждой слэш-команды (и автодополнения).
+
+    interaction_check выполняется в той же задаче, что и сама команда, поэтому трасса
+    видна всем слоям ниже и закрывается вместе с задачей.
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        name = f"/{(interaction.data or {}).get('name', '?')}"
+        if interaction.type is discord.InteractionType.autocomplete:
+            name += " (autocomplete)"
+        tracing.start_trace(name, interaction)
+        return True
+
+
+class KeyMasterBot(BotBase):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.guilds = True  # ЭТО ВАЖНО для работы с серверами и эмодзи
         intents.members = True # Желательно для профилей
-        super().__init__(command_prefix="!", intents=intents)
-        self.db = Database()  # Инициализация экземпляра базы данных
+        # Профиль памяти: в LOW_MEMORY участники не кэшируются и не запрашиваются целиком при старте
+        # (нужны только ID для упоминаний и профилей), кэш сообщений выключен
+        memory_options = {
+            "max_messages": memory.MAX_MESSAGES or None,
+        }
+        if memory.LOW_MEMORY:
+            memory_options["member_cache_flags"] = discord.MemberCacheFlags.none()
+            memory_options["chunk_guilds_at_startup"] = False
+        shard_options = {}
+        if cluster.AUTO_SHARD:
+            if cluster.SHARD_COUNT:
+                shard_options["shard_count"] = cluster.SHARD_COUNT
+            if cluster.SHARD_IDS is not None:
+                shard_options["shard_ids"] = cluster.SHARD_IDS
+        super().__init__(
+            command_prefix="!", intents=intents, tree_cls=TracedCommandTree, **memory_options, **shard_options
+        )
+        self.db = Database()  # Единственный экземпляр базы данных (одно долгоживущее соединение) для всех когов
+        self.raiderio = raiderio.client  # Общий HTTP-клиент Raider.IO с пулом соединений
+        self.snapshots = SnapshotCache(self.db)  # Снимки профилей Raider.IO (память + SQLite)
+        # Снимки участников LFG (CharacterSnapshot): stale-while-revalidate, не больше одного обновления на пользователя
+        self.member_stats = RefreshManager(
+            self._load_member_stats, self._refresh_member_stats, name="member_stats", fresh_ttl=300, stale_ttl=6 * 3600
+        )
+        # Рейтинги по серверам Discord в памяти; обновляются при каждой записи в users
+        self.leaderboards = GuildLeaderboards()
+        self.db.score_listeners.append(self.leaderboards.update_character)
+        # Слоты LFG живут в памяти; в БД они уходят пакетами со склейкой по message_id
+        self.lfg_writer = WriteBehindQueue(self.db.update_lfg_slots_many, interval=0.25, name="lfg-slots")
+        # Состояние сборов по message_id, загружается лениво при клике по кнопке
+        self.lfg_store = LFGStore(self.db, self.lfg_writer)
+        # Правки сообщений LFG: не больше одной за окно на сообщение, последней уходит актуальная
+        self.lfg_edits = EditDebouncer(window=LFG_EDIT_WINDOW, name="lfg-edits")
+        self._leaderboard_sync: Optional[asyncio.Task] = None
+        self._command_sync: Optional[asyncio.Task] = None
+        self._metrics_runner = None
+        metrics.register_collector(self._collect_metrics)
+        # Профиль запуска: фазы setup_hook и загрузка когов (выводится в лог при ready и командой /startup)
+        self.startup = StartupProfile()
+
+    async def _load_member_stats(self, user_id: int):
+        """Снимок участника из локальной БД (используется, когда в кэше ничего нет)."""
+        return await self.db.get_user(user_id)
+
+    async def _refresh_member_stats(self, user_id: int):
+        """Свежий снимок участника с Raider.IO; заодно обновляет запись в БД."""
+        user = await self.db.get_user(user_id)
+        if not user:
+            return None
+        char = await self.snapshots.fetch(user.name, user.realm, user.region, "score")
+        if not char:
+            return None
+        char = char.for_user(user_id)
+        await self.db.save_character(char)
+        return char
 
     async def setup_hook(self):
-        # Инициализация базы данных
-        await self.db.create_tables()  # Используем экземпляр базы данных
+        # Подготовка хранилища (БД + прогрев рейтингов) идёт параллельно с загрузкой когов, сами коги
+        # грузятся по очереди (коги не обращаются к БД до on_ready). Длительности пишутся в self.startup.
+        await asyncio.gather(self._setup_storage(), self._load_cogs())
 
-        # Загрузка когов (путь относительно файла)
-        cogs_dir = Path(__file__).parent / "cogs"
-        if cogs_dir.exists() and cogs_dir.is_dir():
-            for path in cogs_dir.iterdir():
-                if path.suffix == ".py" and path.name != "__init__.py":
-                    try:
-                        await self.load_extension(f"cogs.{path.stem}")
-                        logger.info(f"✅ Ког загружен: {path.name}")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка загрузки {path.name}: {e}", exc_info=True)
-        else:
-            logger.warning(f"Папка cogs не найдена по пути: {cogs_dir}")
+        if METRICS_PORT:
+            try:
+                self._metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT + cluster.CLUSTER_ID)
+            except Exception:
+                logger.exception("Не удалось запустить HTTP-сервер метрик")
 
-        # Синхронизация слэш-команд
-        try:
-            await self.tree.sync()
-            logger.info("🔁 Слэш-команды синхронизированы!")
-        except Exception as e:
-            logger.error(f"❌ Ошибка синхронизации слэш-команд: {e}", exc_info=True)
+        # Периодическая очистка истёкших записей in-memory кэша
+        cache.start_sweeper()
+        self.lfg_writer.start()
+        if cluster.CLUSTER_COUNT > 1:
+            # Рейтинги чужих пользователей обновляют другие процессы — подтягиваем их из БД
+            self._leaderboard_sync = asyncio.create_task(self._sync_leaderboards())
+
+        # Синхронизация слэш-команд — в фоне и только если дерево изменилось
+        # (глобальная: в кластере её делает один процесс; DEV_GUILD_ID — синхронизация в одну гильдию)
+        if cluster.is_primary():
+            self._command_sync = asyncio.create_task(self._sync_commands())
 
         # Регистрируем глобальный обработчик ошибок для слэш-команд на уровне Tree
         @self.tree.error
@@ -71,8 +170,100 @@ class KeyMasterBot(commands.Bot):
                 # Если отправка ответа упала — просто логируем
                 logger.exception("Не удалось отправить сообщение об ошибке в интеракшн")
 
+    async def _setup_storage(self):
+        # Инициализация базы данных
+        with self.startup.phase("db.create_tables"):
+            await self.db.create_tables()
+        with self.startup.phase("leaderboards.load"):
+            self.leaderboards.load(await self.db.get_leaderboard_characters(), await self.db.get_guild_members())
+
+    async def _load_cogs(self):
+        # Загрузка когов (путь относительно файла)
+        cogs_dir = Path(__file__).parent / "cogs"
+        if not (cogs_dir.exists() and cogs_dir.is_dir()):
+            logger.warning(f"Папка cogs не найдена по пути: {cogs_dir}")
+            return
+        paths = [p for p in sorted(cogs_dir.iterdir()) if p.suffix == ".py" and p.name != "__init__.py"]
+        # load_extension исполняет модуль синхронно, поэтому коги грузятся по очереди;
+        # параллельно с ними идёт только подготовка хранилища (см. setup_hook)
+        with self.startup.phase("cogs"):
+            for path in paths:
+                await self._load_cog(path)
+
+    async def _load_cog(self, path: Path):
+        name = f"cogs.{path.stem}"
+        try:
+            with self.startup.phase(path.stem, "ext"):
+                await self.load_extension(name)
+            logger.info(f"✅ Ког загружен: {path.name}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки {path.name}: {e}", exc_info=True)
+
+    async def _sync_commands(self):
+        try:
+            with self.startup.phase("tree.sync", "bg"):
+                await sync_if_changed(self, guild_id=DEV_GUILD_ID, force=FORCE_COMMAND_SYNC)
+        except Exception as e:
+            logger.error(f"❌ Ошибка синхронизации слэш-команд: {e}", exc_info=True)
+
+    def _collect_metrics(self):
+        """Метрики, которые уже считают компоненты бота (отдаются при скрейпе /metrics)."""
+        yield "discord_guilds", "gauge", "Гильдии, обслуживаемые процессом", {}, len(self.guilds)
+        if self.is_ready():
+            yield "discord_gateway_latency_seconds", "gauge", "Задержка heartbeat шлюза Discord", {}, self.latency
+        for key, value in self.lfg_writer.stats.items():
+            yield "writebehind_events_total", "counter", "События очереди отложенной записи", {"queue": self.lfg_writer.name, "event": key}, value
+        yield "writebehind_pending", "gauge", "Ключи, ждущие записи", {"queue": self.lfg_writer.name}, len(self.lfg_writer)
+        for key, value in self.lfg_edits.stats.items():
+            yield "lfg_edits_total", "counter", "Правки сообщений LFG (saved — заменены более свежей до отправки)", {"outcome": key}, value
+        yield "lfg_edits_pending", "gauge", "Сообщения LFG с ожидающей правкой", {}, len(self.lfg_edits)
+        for key, value in self.member_stats.metrics.items():
+            yield "refresh_cache_events_total", "counter", "События stale-while-revalidate кэша", {"cache": self.member_stats.name, "event": key}, value
+
+    async def _sync_leaderboards(self):
+        while True:
+            await asyncio.sleep(LEADERBOARD_SYNC_INTERVAL)
+            try:
+                self.leaderboards.refresh_scores(await self.db.get_leaderboard_characters())
+            except Exception:
+                logger.exception("Ошибка синхронизации рейтингов из БД")
+
+    async def close(self):
+        # Сначала останавливаем приём событий: commands.Bot.close() выгружает коги (их фоновые
+        # циклы дожидаются остановки в cog_unload) и закрывает шлюз и HTTP. Только после этого
+        # новых изменений слотов не появится, и очереди можно сбросить, а БД — закрыть.
+        await super().close()
+        for task in (self._leaderboard_sync, self._command_sync):
+            if task is not None:
+                task.cancel()
+        cache.stop_sweeper()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        await self.member_stats.stop()
+        # Отложенные правки сообщений отбрасываются (HTTP уже закрыт), состояние слотов — в lfg_writer
+        await self.lfg_edits.close()
+        try:
+            # Сбрасываем накопленные изменения слотов LFG до закрытия БД
+            await self.lfg_writer.close()
+        except Exception:
+            logger.exception("Ошибка при сбросе очереди записи LFG")
+        try:
+            await self.raiderio.close()
+        except Exception:
+            logger.exception("Ошибка при закрытии HTTP-клиента Raider.IO")
+        try:
+            await self.db.close()
+        except Exception:
+            logger.exception("Ошибка при закрытии соединения с базой данных")
+
     async def on_ready(self):
-        logger.info(f"🤖 Бот запущен как {self.user}")
+        if self.startup.ready_at is None:
+            self.startup.mark_ready()
+            logger.info(f"⏱️ {self.startup.report()}")
+        if cluster.AUTO_SHARD:
+            logger.info(f"🤖 Бот запущен как {self.user} (кластер {cluster.CLUSTER_ID}/{cluster.CLUSTER_COUNT}, шарды {sorted(self.shards)})")
+        else:
+            logger.info(f"🤖 Бот запущен как {self.user}")
 
 async def main():
     # Запуск бота
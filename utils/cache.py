@@ -1,56 +1,169 @@
 import time
 import asyncio
+import logging
+from collections import OrderedDict
 from typing import Any, Optional
 
+from utils import metrics
+from utils.memory import CACHE_MAXSIZE
 
-class SimpleTTLCache:
-    """Простейший in-memory TTL cache.
+logger = logging.getLogger(__name__)
 
-    Хранит значения в виде {key: (value, expires_at)}.
-    Потокобезопасен для записи через asyncio.Lock.
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """In-memory LRU + TTL cache с O(1) get/set/evict.
+
+    Хранит значения в OrderedDict {key: (value, expires_at)} в порядке использования:
+    get/set переносят ключ в конец, при переполнении вытесняется самый давно использованный.
+    Работает в одном event loop, поэтому блокировки не нужны. Истёкшие записи удаляются
+    при чтении и периодическим sweep(). Асинхронный API (get/set/delete/clear) сохранён
+    для совместимости с вызывающим кодом.
+
+    namespace() создаёт именованный под-кэш со своими лимитом размера и TTL (не больше лимита
+    корневого кэша); все под-кэши обслуживаются одним фоновым sweeper'ом корневого кэша.
     """
 
-    def __init__(self, default_ttl: int = 300, maxsize: Optional[int] = 10000):
-        self._store: dict[Any, tuple[Any, float]] = {}
-        self._lock = asyncio.Lock()
+    def __init__(self, default_ttl: int = 300, maxsize: Optional[int] = 10000, name: str = "default"):
+        self._store: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
         self.default_ttl = default_ttl
         self.maxsize = maxsize
+        self.name = name
+        self._namespaces: dict[str, "LRUTTLCache"] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
-    async def set(self, key: Any, value: Any, ttl: Optional[int] = None) -> None:
-        if ttl is None:
-            ttl = self.default_ttl
-        expires_at = time.monotonic() + ttl
-        async with self._lock:
-            # Простая эвикция по размеру
-            if self.maxsize and len(self._store) >= self.maxsize:
-                # удаляем случайный/первый элемент (простая эвикция)
-                try:
-                    oldest = next(iter(self._store))
-                    self._store.pop(oldest, None)
-                except StopIteration:
-                    pass
-            self._store[key] = (value, expires_at)
+    def __len__(self) -> int:
+        return len(self._store)
 
-    async def get(self, key: Any) -> Optional[Any]:
-        item = self._store.get(key)
-        if not item:
-            return None
+    def get_nowait(self, key: Any, default: Any = None) -> Any:
+        item = self._store.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
         value, expires_at = item
         if time.monotonic() >= expires_at:
-            # удаляем устаревшую запись
-            async with self._lock:
-                self._store.pop(key, None)
-            return None
+            del self._store[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._store.move_to_end(key)
+        self.hits += 1
         return value
 
+    def set_nowait(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.default_ttl
+        store = self._store
+        if key in store:
+            store.move_to_end(key)
+        elif self.maxsize and len(store) >= self.maxsize:
+            store.popitem(last=False)
+            self.evictions += 1
+        store[key] = (value, time.monotonic() + ttl)
+
+    def values_nowait(self) -> list:
+        """Неистёкшие значения (без обновления порядка LRU и статистики попаданий)."""
+        now = time.monotonic()
+        return [value for value, expires_at in self._store.values() if expires_at > now]
+
+    def delete_nowait(self, key: Any) -> None:
+        self._store.pop(key, None)
+
+    async def get(self, key: Any) -> Optional[Any]:
+        return self.get_nowait(key)
+
+    async def set(self, key: Any, value: Any, ttl: Optional[int] = None) -> None:
+        self.set_nowait(key, value, ttl)
+
     async def delete(self, key: Any) -> None:
-        async with self._lock:
-            self._store.pop(key, None)
+        self.delete_nowait(key)
 
     async def clear(self) -> None:
-        async with self._lock:
-            self._store.clear()
+        self._store.clear()
+
+    def namespace(self, name: str, maxsize: Optional[int] = None, default_ttl: Optional[int] = None) -> "LRUTTLCache":
+        """Возвращает (создавая при первом обращении) именованный под-кэш."""
+        ns = self._namespaces.get(name)
+        if ns is None:
+            if maxsize is None or (self.maxsize and maxsize > self.maxsize):
+                maxsize = self.maxsize
+            ns = LRUTTLCache(
+                default_ttl=default_ttl if default_ttl is not None else self.default_ttl,
+                maxsize=maxsize,
+                name=name,
+            )
+            self._namespaces[name] = ns
+        return ns
+
+    def sweep(self) -> int:
+        """Удаляет все истёкшие записи этого кэша и его под-кэшей. Возвращает число удалённых."""
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._store.items() if expires_at <= now]
+        for key in expired:
+            del self._store[key]
+        self.expirations += len(expired)
+        removed = len(expired)
+        for ns in self._namespaces.values():
+            removed += ns.sweep()
+        return removed
+
+    def start_sweeper(self, interval: float = 60.0) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug("Кэш: удалено %d истёкших записей", removed)
+            except Exception:
+                logger.exception("Ошибка при очистке кэша")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._store),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def all_stats(self) -> dict[str, dict]:
+        """Статистика корневого кэша и всех под-кэшей по именам."""
+        result = {self.name: self.stats()}
+        for ns in self._namespaces.values():
+            result.update(ns.all_stats())
+        return result
+
+
+# Синглтон кэша по умолчанию (лимит зависит от профиля памяти, см. utils/memory.py)
+cache = LRUTTLCache(maxsize=CACHE_MAXSIZE)
+
+
+def _collect_metrics():
+    for name, stats in cache.all_stats().items():
+        labels = {"cache": name}
+        yield "cache_entries", "gauge", "Записей в кэше", labels, stats["size"]
+        yield "cache_hits_total", "counter", "Попадания в кэш", labels, stats["hits"]
+        yield "cache_misses_total", "counter", "Промахи кэша", labels, stats["misses"]
+        yield "cache_evictions_total", "counter", "Вытеснения по лимиту размера", labels, stats["evictions"]
+        yield "cache_expirations_total", "counter", "Удаления по TTL", labels, stats["expirations"]
 
 
-# Синглтон кэша по умолчанию
-cache = SimpleTTLCache()
+metrics.register_collector(_collect_metrics)
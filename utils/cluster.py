@@ -0,0 +1,59 @@
+"""Параметры шардинга и кластера (несколько процессов бота на одну БД).
+
+Задаются переменными окружения; launcher.py выставляет их для каждого процесса сам:
+  AUTO_SHARD=1      — запускать бота как AutoShardedBot
+  SHARD_COUNT       — общее число шардов (пусто — рекомендованное Discord)
+  SHARD_IDS         — шарды этого процесса: "0,1,2" или "0-2"
+  CLUSTER_ID        — номер процесса (с 0)
+  CLUSTER_COUNT     — число процессов
+Фоновые задачи, которые должны выполняться один раз на всю БД, делятся между процессами:
+пользователь принадлежит кластеру discord_id % CLUSTER_COUNT, общие задачи выполняет кластер 0.
+"""
+import os
+from typing import Optional
+
+
+def parse_shard_ids(value: Optional[str]) -> Optional[list[int]]:
+    """"0,1,2" / "0-2" / "0-1,4" → [0, 1, 2] ...; пусто → None."""
+    if not value or not value.strip():
+        return None
+    result: list[int] = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            result.extend(range(int(start), int(end) + 1))
+        else:
+            result.append(int(part))
+    return sorted(set(result))
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+    """Делит шарды 0..shard_count-1 на clusters непрерывных диапазонов почти равного размера."""
+    clusters = max(1, min(clusters, shard_count))
+    base, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+AUTO_SHARD = os.getenv("AUTO_SHARD", "0") == "1"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))
+CLUSTER_COUNT = max(1, int(os.getenv("CLUSTER_COUNT", "1")))
+
+
+def is_primary() -> bool:
+    """Процесс, выполняющий общие для всей БД задачи (синхронизация команд, очистка LFG)."""
+    return CLUSTER_ID == 0
+
+
+def owns_user(discord_id: int) -> bool:
+    """Этот процесс отвечает за фоновое обновление пользователя."""
+    return CLUSTER_COUNT == 1 or discord_id % CLUSTER_COUNT == CLUSTER_ID
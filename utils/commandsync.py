@@ -0,0 +1,53 @@
+"""Синхронизация слэш-команд только при изменении дерева.
+
+Дерево команд сериализуется в тот же JSON, что уходит в Discord при sync, и хэшируется;
+хэш последней успешной синхронизации хранится в bot_meta. Совпал — sync пропускается.
+"""
+import hashlib
+import json
+import logging
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+
+def _command_payload(command, tree: app_commands.CommandTree) -> dict:
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        # Старые версии discord.py: to_dict() без аргументов
+        return command.to_dict()
+
+
+def tree_hash(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Стабильный хэш команд дерева (глобальных или одной гильдии)."""
+    payload = [_command_payload(cmd, tree) for cmd in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda c: (c.get("type", 1), c.get("name", "")))
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def sync_if_changed(bot, guild_id: Optional[int] = None, force: bool = False) -> bool:
+    """Синхронизирует команды, если их хэш отличается от сохранённого. True — sync выполнялся.
+
+    guild_id — режим разработки: глобальные команды копируются в одну гильдию
+    и синхронизируются там (обновляются сразу, без глобального лимита).
+    """
+    tree = bot.tree
+    guild = discord.Object(id=guild_id) if guild_id else None
+    if guild is not None:
+        tree.copy_global_to(guild=guild)
+
+    digest = tree_hash(tree, guild)
+    key = f"command_tree_hash:{bot.application_id}:{guild_id or 'global'}"
+    if not force and await bot.db.get_meta(key) == digest:
+        logger.info("🔁 Слэш-команды не изменились — синхронизация пропущена")
+        return False
+
+    await tree.sync(guild=guild)
+    await bot.db.set_meta(key, digest)
+    logger.info("🔁 Слэш-команды синхронизированы%s", f" (гильдия {guild_id})" if guild_id else "")
+    return True
@@ -1,14 +1,91 @@
 import aiosqlite
+import asyncio
+import logging
 import os
-import json
+import time
+from utils import jsoncodec, metrics
+from utils.lfg import LFG_TTL
+from utils.models import CharacterSnapshot
+from typing import Callable, Iterable, Optional
 
+# PRAGMA для долгоживущего соединения: WAL + synchronous=NORMAL убирают fsync на каждый commit,
+# cache_size в KiB (отрицательное значение), temp_store/mmap ускоряют чтение.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+    # Ожидание блокировки записи: в кластерном режиме в одну БД пишут несколько процессов
+    f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))}",
+)
+# Размер кэша подготовленных выражений sqlite3 (повторное использование statements)
+CACHED_STATEMENTS = 256
 
+
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "Время вызова метода Database (включая ожидание блокировки записи)", ["method"])
+DB_ERRORS = metrics.counter("db_errors_total", "Исключения в методах Database", ["method"])
+
+
+@metrics.instrument_methods(DB_QUERY_SECONDS, DB_ERRORS, exclude=("connect", "close"), span="db")
 class Database:
     def __init__(self, db_name: str = 'bot.db'):
         self.db_name = db_name
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        # После close() соединение не переоткрывается: поздний вызов получит ошибку, а не утечку соединения
+        self._closed = False
+        # Все записи идут через одно соединение; лок не даёт commit'у одной корутины
+        # зафиксировать незавершённые изменения другой.
+        self._write_lock = asyncio.Lock()
+        # Вызываются после каждой записи в users: (discord_id, name, realm, score, char_class)
+        self.score_listeners: list[Callable[[int, str, str, float, Optional[str]], None]] = []
+
+    async def connect(self) -> aiosqlite.Connection:
+        """Открывает (один раз) общее соединение и применяет PRAGMA."""
+        if self._conn is not None:
+            return self._conn
+        if self._closed:
+            raise RuntimeError("База данных уже закрыта")
+        async with self._connect_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.db_name, cached_statements=CACHED_STATEMENTS)
+                for pragma in CONNECTION_PRAGMAS:
+                    await conn.execute(pragma)
+                conn.row_factory = aiosqlite.Row
+                self._conn = conn
+        return self._conn
+
+    async def close(self):
+        self._closed = True
+        if self._conn is None:
+            return
+        try:
+            await self._conn.execute("PRAGMA optimize")
+        except Exception:
+            pass
+        await self._conn.close()
+        self._conn = None
+
+    async def _write(self, sql: str, params: tuple = ()):
+        db = await self.connect()
+        async with self._write_lock:
+            await db.execute(sql, params)
+            await db.commit()
+
+    async def _fetchone(self, sql: str, params: tuple = ()):
+        db = await self.connect()
+        async with db.execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    async def _fetchall(self, sql: str, params: tuple = ()):
+        db = await self.connect()
+        async with db.execute(sql, params) as cursor:
+            return await cursor.fetchall()
 
     async def create_tables(self):
-        async with aiosqlite.connect(self.db_name) as db:
+        db = await self.connect()
+        async with self._write_lock:
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     discord_id INTEGER PRIMARY KEY,
@@ -45,7 +122,9 @@ class Database:
                     tank INTEGER,
                     healer INTEGER,
                     dps TEXT,
-                    embed_json TEXT
+                    embed_json TEXT,
+                    created_at REAL,
+                    expires_at REAL
                 )
             ''')
             await db.commit()
@@ -58,75 +137,262 @@ class Database:
                     if 'embed_json' not in col_names:
                         await db.execute('ALTER TABLE lfg_messages ADD COLUMN embed_json TEXT')
                         await db.commit()
+                    if 'expires_at' not in col_names:
+                        # Старым сборам срок жизни отсчитываем от момента миграции
+                        now = time.time()
+                        await db.execute('ALTER TABLE lfg_messages ADD COLUMN created_at REAL')
+                        await db.execute('ALTER TABLE lfg_messages ADD COLUMN expires_at REAL')
+                        await db.execute('UPDATE lfg_messages SET created_at = ?, expires_at = ?', (now, now + LFG_TTL))
+                        await db.commit()
+            except Exception:
+                pass
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_lfg_messages_expires ON lfg_messages (expires_at)')
+            await db.commit()
+
+            # Снимки профилей Raider.IO (zlib-сжатый JSON) — переживают рестарт.
+            # Одна строка на (персонаж, набор полей); fields — отсортированный список полей через запятую.
+            try:
+                async with db.execute("PRAGMA table_info(rio_snapshots)") as cursor:
+                    col_names = [c[1] for c in await cursor.fetchall()]
+                if col_names and 'fields' not in col_names:
+                    # Старый формат без набора полей: это только кэш, пересоздаём
+                    await db.execute('DROP TABLE rio_snapshots')
+                    await db.commit()
             except Exception:
                 pass
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS rio_snapshots (
+                    region TEXT NOT NULL,
+                    realm_slug TEXT NOT NULL,
+                    character_name TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (region, realm_slug, character_name, fields)
+                )
+            ''')
+            await db.commit()
+
+            # Привязка пользователей к гильдиям Discord (для рейтинга сервера).
+            # rio_score денормализован из users, чтобы индекс (guild_id, rio_score) покрывал /top.
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS guild_members (
+                    guild_id INTEGER NOT NULL,
+                    discord_id INTEGER NOT NULL,
+                    rio_score REAL DEFAULT 0,
+                    PRIMARY KEY (guild_id, discord_id)
+                )
+            ''')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_guild_members_score ON guild_members (guild_id, rio_score DESC)')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_guild_members_user ON guild_members (discord_id)')
+            await db.commit()
+
+            # Служебные значения бота (например, хэш дерева слэш-команд последней синхронизации)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS bot_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            await db.commit()
 
     async def register_user(self, discord_id, name, realm, region, score, char_class, thumbnail, item_level=None):
-        async with aiosqlite.connect(self.db_name) as db:
+        db = await self.connect()
+        async with self._write_lock:
             await db.execute('''
-                INSERT OR REPLACE INTO users 
+                INSERT OR REPLACE INTO users
                 (discord_id, character_name, realm_slug, region, rio_score, character_class, thumbnail_url, item_level, last_updated)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (discord_id, name, realm, region, score, char_class, thumbnail, item_level))
+            await db.execute('UPDATE guild_members SET rio_score = ? WHERE discord_id = ?', (score, discord_id))
             await db.commit()
+        self._notify_score(discord_id, name, realm, score, char_class)
+
+    def _notify_score(self, discord_id, name, realm, score, char_class):
+        for listener in self.score_listeners:
+            try:
+                listener(discord_id, name, realm, score, char_class)
+            except Exception:
+                logging.getLogger(__name__).exception("Ошибка в обработчике изменения рейтинга")
 
-    async def get_user(self, discord_id):
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT discord_id, character_name, realm_slug, region, rio_score, character_class, thumbnail_url, item_level FROM users WHERE discord_id = ?', (discord_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    # Возвращаем кортеж для совместимости с существующими вызовами кода
-                    return tuple(row)
-                return None
-
-    async def get_all_users(self):
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT discord_id, character_name, realm_slug, region FROM users') as cursor:
-                rows = await cursor.fetchall()
-                return [tuple(row) for row in rows]
+    async def save_character(self, snapshot: CharacterSnapshot):
+        """register_user() для разобранного снимка с заполненным discord_id."""
+        await self.register_user(
+            snapshot.discord_id, snapshot.name, snapshot.realm, snapshot.region, snapshot.rio_score,
+            snapshot.char_class, snapshot.thumbnail_url, snapshot.item_level,
+        )
+
+    async def upsert_characters(self, snapshots: list[CharacterSnapshot], snapshot_rows: Iterable[tuple] = ()) -> int:
+        """Пакетная запись снимков (с discord_id) одной транзакцией.
+
+        Строки, у которых имя, рейтинг, класс, ilvl и миниатюра не изменились, не пишутся.
+        snapshot_rows — строки rio_snapshots (region, realm, name, fields, payload, fetched_at),
+        записываемые в той же транзакции. Возвращает число реально изменённых строк users.
+        """
+        snapshot_rows = list(snapshot_rows)
+        if not snapshots and not snapshot_rows:
+            return 0
+        db = await self.connect()
+        by_id = {s.discord_id: s for s in snapshots}
+        ids = list(by_id)
+        existing: dict[int, tuple] = {}
+        # Ограничение SQLite на число параметров — читаем порциями
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            async with db.execute(
+                f'SELECT discord_id, character_name, rio_score, character_class, thumbnail_url, item_level FROM users WHERE discord_id IN ({placeholders})',
+                chunk,
+            ) as cursor:
+                for r in await cursor.fetchall():
+                    existing[r[0]] = tuple(r)[1:]
+
+        changed = [
+            s for s in by_id.values()
+            if existing.get(s.discord_id) != (s.name, s.rio_score, s.char_class, s.thumbnail_url, s.item_level)
+        ]
+        if not changed and not snapshot_rows:
+            return 0
+
+        async with self._write_lock:
+            if snapshot_rows:
+                await db.executemany('''
+                    INSERT OR REPLACE INTO rio_snapshots (region, realm_slug, character_name, fields, payload, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', snapshot_rows)
+            await db.executemany('''
+                INSERT OR REPLACE INTO users
+                (discord_id, character_name, realm_slug, region, rio_score, character_class, thumbnail_url, item_level, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [
+                (s.discord_id, s.name, s.realm, s.region, s.rio_score, s.char_class, s.thumbnail_url, s.item_level)
+                for s in changed
+            ])
+            await db.executemany(
+                'UPDATE guild_members SET rio_score = ? WHERE discord_id = ? AND rio_score IS NOT ?',
+                [(s.rio_score, s.discord_id, s.rio_score) for s in changed],
+            )
+            await db.commit()
+        for s in changed:
+            self._notify_score(s.discord_id, s.name, s.realm, s.rio_score, s.char_class)
+        return len(changed)
+
+    async def get_user(self, discord_id) -> Optional[CharacterSnapshot]:
+        row = await self._fetchone('SELECT discord_id, character_name, realm_slug, region, rio_score, character_class, thumbnail_url, item_level FROM users WHERE discord_id = ?', (discord_id,))
+        if row:
+            return CharacterSnapshot.from_row(tuple(row))
+        return None
+
+    async def get_all_users(self) -> list[CharacterSnapshot]:
+        rows = await self._fetchall('SELECT discord_id, character_name, realm_slug, region FROM users')
+        return [CharacterSnapshot.from_row(tuple(row)) for row in rows]
 
     async def get_top_users(self, limit=10):
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT character_name, realm_slug, rio_score, character_class FROM users ORDER BY rio_score DESC LIMIT ?', (limit,)) as cursor:
-                rows = await cursor.fetchall()
-                return [tuple(row) for row in rows]
+        rows = await self._fetchall('SELECT character_name, realm_slug, rio_score, character_class FROM users ORDER BY rio_score DESC LIMIT ?', (limit,))
+        return [tuple(row) for row in rows]
 
-    # --- LFG persistence methods ---
-    async def save_lfg(self, message_id: int, channel_id: int, author_id: int, tank: int | None = None, healer: int | None = None, dps: list | None = None, embed_json: str | None = None):
-        dps_json = json.dumps(dps or [])
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute('''
-                INSERT OR REPLACE INTO lfg_messages (message_id, channel_id, author_id, tank, healer, dps, embed_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (message_id, channel_id, author_id, tank, healer, dps_json, embed_json))
+    # --- Guild membership (рейтинг сервера) ---
+    async def add_guild_members(self, pairs: list[tuple[int, int]]):
+        """Привязывает зарегистрированных пользователей к гильдиям: pairs — (guild_id, discord_id)."""
+        if not pairs:
+            return
+        db = await self.connect()
+        async with self._write_lock:
+            await db.executemany('''
+                INSERT OR IGNORE INTO guild_members (guild_id, discord_id, rio_score)
+                SELECT ?, discord_id, rio_score FROM users WHERE discord_id = ?
+            ''', pairs)
             await db.commit()
 
-    async def get_active_lfgs(self):
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT message_id, channel_id, author_id, tank, healer, dps, embed_json FROM lfg_messages') as cursor:
-                rows = await cursor.fetchall()
-                results = []
-                for r in rows:
-                    dps_list = json.loads(r['dps']) if r['dps'] else []
-                    embed_dict = None
-                    try:
-                        embed_dict = json.loads(r['embed_json']) if r['embed_json'] else None
-                    except Exception:
-                        embed_dict = None
-                    results.append((r['message_id'], r['channel_id'], r['author_id'], r['tank'], r['healer'], dps_list, embed_dict))
-                return results
+    async def remove_guild_member(self, guild_id: int, discord_id: int):
+        await self._write('DELETE FROM guild_members WHERE guild_id = ? AND discord_id = ?', (guild_id, discord_id))
+
+    async def get_guild_members(self) -> list[tuple[int, int]]:
+        rows = await self._fetchall('SELECT guild_id, discord_id FROM guild_members')
+        return [(r['guild_id'], r['discord_id']) for r in rows]
+
+    async def get_leaderboard_characters(self) -> list[tuple]:
+        """(discord_id, character_name, realm_slug, rio_score, character_class) для всех пользователей."""
+        rows = await self._fetchall('SELECT discord_id, character_name, realm_slug, rio_score, character_class FROM users')
+        return [tuple(r) for r in rows]
+
+    # --- LFG persistence methods ---
+    async def save_lfg(self, message_id: int, channel_id: int, author_id: int, tank: int | None = None, healer: int | None = None, dps: list | None = None, embed_json: str | None = None, ttl: float = LFG_TTL):
+        dps_json = jsoncodec.dumps(dps or [])
+        now = time.time()
+        await self._write('''
+            INSERT OR REPLACE INTO lfg_messages (message_id, channel_id, author_id, tank, healer, dps, embed_json, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (message_id, channel_id, author_id, tank, healer, dps_json, embed_json, now, now + ttl))
+
+    @staticmethod
+    def _lfg_from_row(r) -> tuple:
+        dps_list = jsoncodec.loads(r['dps']) if r['dps'] else []
+        embed_dict = None
+        try:
+            embed_dict = jsoncodec.loads(r['embed_json']) if r['embed_json'] else None
+        except Exception:
+            embed_dict = None
+        return (r['message_id'], r['channel_id'], r['author_id'], r['tank'], r['healer'], dps_list, embed_dict)
+
+    async def get_lfg(self, message_id: int) -> Optional[tuple]:
+        """Строка сбора (см. _lfg_from_row) и в конце expires_at."""
+        row = await self._fetchone('SELECT message_id, channel_id, author_id, tank, healer, dps, embed_json, expires_at FROM lfg_messages WHERE message_id = ?', (message_id,))
+        return self._lfg_from_row(row) + (row['expires_at'],) if row else None
 
     async def update_lfg_slots(self, message_id: int, tank: int | None, healer: int | None, dps: list | None):
-        dps_json = json.dumps(dps or [])
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute('UPDATE lfg_messages SET tank = ?, healer = ?, dps = ? WHERE message_id = ?', (tank, healer, dps_json, message_id))
+        dps_json = jsoncodec.dumps(dps or [])
+        await self._write('UPDATE lfg_messages SET tank = ?, healer = ?, dps = ? WHERE message_id = ?', (tank, healer, dps_json, message_id))
+
+    async def update_lfg_slots_many(self, rows: list[tuple[int, tuple]]):
+        """Пакетное обновление слотов одной транзакцией: rows — (message_id, (tank, healer, dps))."""
+        if not rows:
+            return
+        params = [(tank, healer, jsoncodec.dumps(dps or []), message_id) for message_id, (tank, healer, dps) in rows]
+        db = await self.connect()
+        async with self._write_lock:
+            await db.executemany('UPDATE lfg_messages SET tank = ?, healer = ?, dps = ? WHERE message_id = ?', params)
             await db.commit()
 
     async def delete_lfg(self, message_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute('DELETE FROM lfg_messages WHERE message_id = ?', (message_id,))
-            await db.commit()
\ No newline at end of file
+        await self._write('DELETE FROM lfg_messages WHERE message_id = ?', (message_id,))
+
+    async def get_expired_lfgs(self, now: float, limit: int = 100) -> list[tuple[int, int]]:
+        """Истёкшие сборы (message_id, channel_id), самые старые первыми."""
+        rows = await self._fetchall(
+            'SELECT message_id, channel_id FROM lfg_messages WHERE expires_at <= ? ORDER BY expires_at LIMIT ?',
+            (now, limit),
+        )
+        return [(r['message_id'], r['channel_id']) for r in rows]
+
+    async def delete_lfgs(self, message_ids: list[int]):
+        """Удаление пачки сборов одной транзакцией."""
+        if not message_ids:
+            return
+        db = await self.connect()
+        async with self._write_lock:
+            await db.executemany('DELETE FROM lfg_messages WHERE message_id = ?', [(mid,) for mid in message_ids])
+            await db.commit()
+
+    # --- Bot meta ---
+    async def get_meta(self, key: str) -> Optional[str]:
+        row = await self._fetchone('SELECT value FROM bot_meta WHERE key = ?', (key,))
+        return row['value'] if row else None
+
+    async def set_meta(self, key: str, value: str):
+        await self._write('INSERT OR REPLACE INTO bot_meta (key, value) VALUES (?, ?)', (key, value))
+
+    # --- Raider.IO snapshot methods ---
+    async def get_snapshots(self, region: str, realm: str, name: str):
+        """Все снимки персонажа: список (fields, payload, fetched_at). Ключи уже нормализованы вызывающим."""
+        rows = await self._fetchall(
+            'SELECT fields, payload, fetched_at FROM rio_snapshots WHERE region = ? AND realm_slug = ? AND character_name = ?',
+            (region, realm, name),
+        )
+        return [(r['fields'], r['payload'], r['fetched_at']) for r in rows]
+
+    async def save_snapshot(self, region: str, realm: str, name: str, fields: str, payload: bytes, fetched_at: float):
+        await self._write('''
+            INSERT OR REPLACE INTO rio_snapshots (region, realm_slug, character_name, fields, payload, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (region, realm, name, fields, payload, fetched_at))
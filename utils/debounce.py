@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EditDebouncer:
+    """Склейка частых обновлений одного объекта (например, сообщения Discord) в одно.
+
+    request() запоминает последнюю функцию отправки для ключа; первая заявка запускает задачу,
+    которая ждёт window секунд и вызывает последнюю запомненную функцию. Заявки, пришедшие
+    во время отправки, дают ещё один проход после неё — отправки по ключу строго
+    последовательны, поэтому последним всегда уходит самое свежее состояние.
+    """
+
+    def __init__(self, window: float = 0.5, name: str = "debounce"):
+        self.window = window
+        self.name = name
+        self._latest: dict[Hashable, Callable[[], Awaitable[None]]] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._closed = False
+        self.stats = {"requested": 0, "sent": 0, "saved": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def request(self, key: Hashable, send: Callable[[], Awaitable[None]]) -> None:
+        self.stats["requested"] += 1
+        if key in self._latest:
+            # Предыдущая заявка ещё не отправлена — она заменяется этой
+            self.stats["saved"] += 1
+        self._latest[key] = send
+        if key not in self._tasks:
+            self._schedule(key)
+
+    def _schedule(self, key: Hashable) -> None:
+        task = asyncio.create_task(self._run(key))
+        self._tasks[key] = task
+        # Задача, отменённая до первого шага, не выполняет finally в _run — освобождаем ключ здесь
+        task.add_done_callback(lambda t: self._release(key, t))
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        """Снимает задачу с ключа и, если за это время пришла новая заявка, запускает следующую."""
+        if self._tasks.get(key) is not task:
+            return
+        del self._tasks[key]
+        if key in self._latest and not self._closed:
+            self._schedule(key)
+
+    def cancel(self, key: Hashable) -> None:
+        """Отменяет ожидающую отправку (например, сообщение удалено)."""
+        self._latest.pop(key, None)
+        task: Optional[asyncio.Task] = self._tasks.get(key)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, key: Hashable) -> None:
+        try:
+            while key in self._latest:
+                await asyncio.sleep(self.window)
+                send = self._latest.pop(key, None)
+                if send is None:
+                    return
+                try:
+                    await send()
+                    self.stats["sent"] += 1
+                except Exception:
+                    self.stats["errors"] += 1
+                    logger.exception("%s: ошибка отправки обновления для %s", self.name, key)
+        finally:
+            # Освобождаем ключ без await после последней проверки _latest: заявка, пришедшая позже,
+            # увидит пустой слот и запустит новую задачу, а пришедшая, пока задача отменялась
+            # (cancel()), подхватывается в _release
+            self._release(key, asyncio.current_task())
+
+    async def close(self) -> None:
+        self._closed = True
+        self._latest.clear()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
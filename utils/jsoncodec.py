@@ -0,0 +1,44 @@
+"""Единый JSON-кодек: orjson или msgspec, если установлены, иначе stdlib json.
+
+loads() принимает str или bytes; dumps() возвращает str, dumps_bytes() — bytes.
+Вывод компактный (без пробелов) и в UTF-8 без экранирования не-ASCII.
+"""
+import json
+
+try:
+    import orjson
+
+    BACKEND = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:
+    try:
+        import msgspec
+
+        BACKEND = "msgspec"
+        _encoder = msgspec.json.Encoder()
+        _decoder = msgspec.json.Decoder()
+
+        def loads(data):
+            return _decoder.decode(data)
+
+        def dumps_bytes(obj) -> bytes:
+            return _encoder.encode(obj)
+
+    except ImportError:
+        BACKEND = "json"
+
+        def loads(data):
+            return json.loads(data)
+
+        def dumps_bytes(obj) -> bytes:
+            return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    return dumps_bytes(obj).decode("utf-8")
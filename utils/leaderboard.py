@@ -0,0 +1,122 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+
+class Leaderboard:
+    """Рейтинг одной гильдии Discord: отсортированный список (-score, discord_id).
+
+    Поиск позиции — bisect за O(log n), страница — срез после него;
+    обновление счёта — удаление старой позиции и вставка новой.
+    """
+
+    def __init__(self):
+        self._entries: list[tuple[float, int]] = []
+        self._scores: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, discord_id: int) -> bool:
+        return discord_id in self._scores
+
+    def update(self, discord_id: int, score: float) -> None:
+        score = float(score or 0)
+        old = self._scores.get(discord_id)
+        if old == score:
+            return
+        if old is not None:
+            self._remove_entry(discord_id, old)
+        self._scores[discord_id] = score
+        insort(self._entries, (-score, discord_id))
+
+    def remove(self, discord_id: int) -> None:
+        old = self._scores.pop(discord_id, None)
+        if old is not None:
+            self._remove_entry(discord_id, old)
+
+    def _remove_entry(self, discord_id: int, score: float) -> None:
+        idx = bisect_left(self._entries, (-score, discord_id))
+        if idx < len(self._entries) and self._entries[idx] == (-score, discord_id):
+            del self._entries[idx]
+
+    def rank(self, discord_id: int) -> Optional[int]:
+        """Место пользователя (с 1) или None."""
+        score = self._scores.get(discord_id)
+        if score is None:
+            return None
+        return bisect_left(self._entries, (-score, discord_id)) + 1
+
+    def page(self, page: int, per_page: int = 10) -> list[tuple[int, int, float]]:
+        """Страница (с 0): список (место, discord_id, score)."""
+        start = max(0, page) * per_page
+        return [
+            (start + i + 1, discord_id, -neg_score)
+            for i, (neg_score, discord_id) in enumerate(self._entries[start:start + per_page])
+        ]
+
+    def page_count(self, per_page: int = 10) -> int:
+        return max(1, -(-len(self._entries) // per_page))
+
+
+class GuildLeaderboards:
+    """Рейтинги по гильдиям Discord с данными персонажей для отображения.
+
+    Обновляется инкрементально: update_character() вызывается при каждой записи
+    в users (Database.score_listeners), add_member()/remove_member() — при привязке к гильдии.
+    """
+
+    def __init__(self):
+        self._boards: dict[int, Leaderboard] = {}
+        self._guilds_of: dict[int, set[int]] = {}
+        # discord_id -> (character_name, realm_slug, character_class)
+        self._characters: dict[int, tuple[str, str, Optional[str]]] = {}
+        self._scores: dict[int, float] = {}
+
+    def board(self, guild_id: int) -> Leaderboard:
+        board = self._boards.get(guild_id)
+        if board is None:
+            board = self._boards[guild_id] = Leaderboard()
+        return board
+
+    def is_member(self, guild_id: int, discord_id: int) -> bool:
+        return guild_id in self._guilds_of.get(discord_id, ())
+
+    def has_guilds(self, discord_id: int) -> bool:
+        """Привязан ли пользователь хотя бы к одной гильдии."""
+        return bool(self._guilds_of.get(discord_id))
+
+    def character(self, discord_id: int) -> Optional[tuple[str, str, Optional[str]]]:
+        return self._characters.get(discord_id)
+
+    def update_character(self, discord_id: int, name: str, realm: str, score: float, char_class: Optional[str]) -> None:
+        self._characters[discord_id] = (name, realm, char_class)
+        self._scores[discord_id] = score or 0
+        for guild_id in self._guilds_of.get(discord_id, ()):
+            self.board(guild_id).update(discord_id, score)
+
+    def add_member(self, guild_id: int, discord_id: int) -> None:
+        self._guilds_of.setdefault(discord_id, set()).add(guild_id)
+        self.board(guild_id).update(discord_id, self._scores.get(discord_id, 0))
+
+    def remove_member(self, guild_id: int, discord_id: int) -> None:
+        guilds = self._guilds_of.get(discord_id)
+        if guilds:
+            guilds.discard(guild_id)
+        board = self._boards.get(guild_id)
+        if board:
+            board.remove(discord_id)
+
+    def load(self, characters: Iterable[tuple], memberships: Iterable[tuple[int, int]]) -> None:
+        """Первичная загрузка: characters — (discord_id, name, realm, score, class), memberships — (guild_id, discord_id)."""
+        for discord_id, name, realm, score, char_class in characters:
+            self._characters[discord_id] = (name, realm, char_class)
+            self._scores[discord_id] = score or 0
+        for guild_id, discord_id in memberships:
+            if discord_id in self._characters:
+                self.add_member(guild_id, discord_id)
+
+    def refresh_scores(self, characters: Iterable[tuple]) -> None:
+        """Применяет записи (discord_id, name, realm, score, class), изменённые вне этого процесса."""
+        for discord_id, name, realm, score, char_class in characters:
+            if self._characters.get(discord_id) != (name, realm, char_class) or self._scores.get(discord_id) != (score or 0):
+                self.update_character(discord_id, name, realm, score, char_class)
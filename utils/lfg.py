@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, NamedTuple, Optional
+
+from utils.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DPS_SLOTS = 3
+ROLES = ("tank", "healer", "dps")
+
+# Срок жизни сбора (сек): после него строка удаляется из lfg_messages фоновой очисткой
+LFG_TTL = int(os.getenv("LFG_TTL", str(6 * 3600)))
+
+# Окно склейки правок сообщения сбора (сек): клики внутри окна дают одну правку
+LFG_EDIT_WINDOW = float(os.getenv("LFG_EDIT_WINDOW", "0.75"))
+
+# Сколько отрисованных состояний слотов помнить на один сбор
+RENDER_MEMO_SIZE = 8
+
+# Сколько сборов держать в памяти; остальные подгружаются из БД при первом клике
+LFG_MEMORY_SIZE = int(os.getenv("LFG_MEMORY_SIZE", "500"))
+# Сбор без кликов дольше этого (сек) выгружается из памяти; каждый клик продлевает срок
+LFG_MEMORY_TTL = 3600
+
+
+class LFGState(NamedTuple):
+    """Неизменяемый снимок сбора. Каждое изменение слотов даёт новый снимок с version + 1;
+    отрисовка и запись в БД работают со снимками и не видят промежуточных состояний.
+    """
+    message_id: int
+    channel_id: int
+    author_id: int
+    tank: Optional[int] = None
+    healer: Optional[int] = None
+    dps: tuple[int, ...] = ()
+    # Шаблон embed'а (Embed.to_dict()) без полей слотов
+    embed: Optional[dict] = None
+    version: int = 0
+
+    @classmethod
+    def from_row(cls, row) -> "LFGState":
+        """Строка Database.get_lfg(): (message_id, channel_id, author_id, tank, healer, dps, embed[, expires_at])."""
+        message_id, channel_id, author_id, tank, healer, dps, embed = row[:7]
+        return cls(message_id, channel_id, author_id, tank, healer, tuple(dps or ()), embed)
+
+    @property
+    def is_full(self) -> bool:
+        return self.tank is not None and self.healer is not None and len(self.dps) >= DPS_SLOTS
+
+    @property
+    def members(self) -> list[int]:
+        result = [uid for uid in (self.tank, self.healer) if uid]
+        result.extend(self.dps)
+        return result
+
+    def slot_key(self) -> tuple:
+        """Хэшируемый ключ состояния слотов."""
+        return self.tank, self.healer, self.dps
+
+    def slots(self) -> tuple[Optional[int], Optional[int], list[int]]:
+        """(tank, healer, dps) — в том виде, в каком слоты пишутся в lfg_messages."""
+        return self.tank, self.healer, list(self.dps)
+
+    def with_slots(self, slots: tuple) -> "LFGState":
+        tank, healer, dps = slots
+        return self._replace(tank=tank, healer=healer, dps=tuple(dps or ()))
+
+    def toggle(self, role: str, user_id: int) -> Optional["LFGState"]:
+        """Записывает пользователя на роль или снимает с неё. None — слот занят."""
+        tank, healer, dps = self.tank, self.healer, self.dps
+        if role == "dps":
+            if user_id in dps:
+                dps = tuple(uid for uid in dps if uid != user_id)
+            elif len(dps) >= DPS_SLOTS:
+                return None
+            else:
+                tank = None if tank == user_id else tank
+                healer = None if healer == user_id else healer
+                dps = dps + (user_id,)
+        else:
+            current = tank if role == "tank" else healer
+            if current is not None and current != user_id:
+                return None
+            new_value = None if current == user_id else user_id
+            if new_value is not None:
+                # Переход с другой роли
+                dps = tuple(uid for uid in dps if uid != user_id)
+                if role == "tank":
+                    healer = None if healer == user_id else healer
+                else:
+                    tank = None if tank == user_id else tank
+            if role == "tank":
+                tank = new_value
+            else:
+                healer = new_value
+        return self._replace(tank=tank, healer=healer, dps=dps, version=self.version + 1)
+
+
+class LFGPost:
+    """Единственный писатель состояния одного сбора.
+
+    Клики ставятся в очередь submit(); одна задача-обработчик применяет их строго по порядку
+    и публикует новый снимок, поэтому два одновременных клика не займут один слот, а переход
+    «не собрана → собрана» увидит ровно один из них. Обработчик живёт, только пока очередь не пуста;
+    сборы независимы, общей блокировки нет.
+
+    Здесь же кэш отрисовки (только в памяти): строка участника по discord_id и готовые embed'ы по slot_key().
+    expires_at — время истечения сбора (unix), None — не истекает.
+    """
+
+    __slots__ = ("state", "closed", "expires_at", "lines", "rendered", "_queue", "_worker", "_on_change")
+
+    def __init__(
+        self,
+        state: LFGState,
+        on_change: Optional[Callable[[LFGState, LFGState], None]] = None,
+        expires_at: Optional[float] = None,
+    ):
+        self.state = state
+        self.closed = False
+        self.expires_at = expires_at
+        self.lines: dict[int, str] = {}
+        self.rendered: dict[tuple, Any] = {}
+        self._queue: deque[tuple[str, int, asyncio.Future]] = deque()
+        self._worker: Optional[asyncio.Task] = None
+        self._on_change = on_change
+
+    @property
+    def message_id(self) -> int:
+        return self.state.message_id
+
+    async def submit(self, role: str, user_id: int) -> tuple[LFGState, Optional[LFGState]]:
+        """Применяет клик. Возвращает (снимок до, снимок после); после = None — клик отклонён."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((role, user_id, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        while self._queue:
+            role, user_id, future = self._queue.popleft()
+            if future.done():
+                continue
+            old = self.state
+            new = None if self.closed else old.toggle(role, user_id)
+            if new is not None:
+                self.state = new
+                if self._on_change is not None:
+                    try:
+                        self._on_change(old, new)
+                    except Exception:
+                        logger.exception("LFG %s: ошибка обработчика изменения", old.message_id)
+            future.set_result((old, new))
+
+    def remember_render(self, key: tuple, rendered: Any) -> None:
+        if len(self.rendered) >= RENDER_MEMO_SIZE:
+            self.rendered.pop(next(iter(self.rendered)))
+        self.rendered[key] = rendered
+
+    def update_line(self, user_id: int, line: str) -> bool:
+        """Заменяет запомненную строку участника; при изменении сбрасывает готовые embed'ы.
+
+        True — участник сейчас в сборе и его строка изменилась (сообщение нужно перерисовать).
+        """
+        if user_id not in self.lines or self.lines[user_id] == line:
+            return False
+        self.lines[user_id] = line
+        if user_id not in self.state.members:
+            return False
+        self.rendered.clear()
+        return True
+
+    def close(self) -> None:
+        """Сбор закрыт: оставшиеся в очереди и новые клики отклоняются."""
+        self.closed = True
+
+
+class LFGStore:
+    """Сборы (LFGPost) по message_id: память (LRU) → lfg_messages. Загрузка ленивая — только при клике.
+
+    Каждое изменение слотов уходит в БД через очередь отложенной записи (writer) в порядке применения;
+    если сбор вытеснен из памяти раньше, чем очередь сброшена, при загрузке поверх строки БД
+    накладывается ещё не записанное значение.
+
+    Истёкший сбор (expires_at в прошлом) считается отсутствующим и при загрузке, и в памяти: фоновая
+    очистка идёт только в основном процессе кластера, остальные процессы узнают об истечении так.
+    """
+
+    def __init__(self, db, writer, maxsize: int = LFG_MEMORY_SIZE, ttl: int = LFG_MEMORY_TTL):
+        self.db = db
+        self.writer = writer
+        self._memory = cache.namespace("lfg", maxsize=maxsize, default_ttl=ttl)
+        self._loading: dict[int, asyncio.Task] = {}
+
+    async def get(self, message_id: int) -> Optional[LFGPost]:
+        post = self._memory.get_nowait(message_id)
+        if post is not None:
+            if self._expired(post.expires_at):
+                self.discard(message_id)
+                return None
+            # Скользящий TTL: из памяти уходит только сбор, по которому давно не кликали,
+            # активный не перезагружается из БД с потерей очереди и кэша отрисовки
+            self._memory.set_nowait(message_id, post)
+            return post
+        # Одновременные клики по холодному сбору ждут одну загрузку и получают один объект
+        task = self._loading.get(message_id)
+        if task is None:
+            task = asyncio.create_task(self._load(message_id))
+            self._loading[message_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(message_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, message_id: int) -> Optional[LFGPost]:
+        try:
+            row = await self.db.get_lfg(message_id)
+        except Exception:
+            logger.exception("Не удалось прочитать LFG %s из БД", message_id)
+            return None
+        if row is None:
+            return None
+        expires_at = row[7]
+        if self._expired(expires_at):
+            return None
+        state = LFGState.from_row(row)
+        pending = self.writer.pending(message_id)
+        if pending is not None:
+            state = state.with_slots(pending)
+        return self.add(state, expires_at)
+
+    @staticmethod
+    def _expired(expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= time.time()
+
+    def _persist(self, old: LFGState, new: LFGState) -> None:
+        # Клик не ждёт диска; повторные изменения одного сбора склеиваются в очереди
+        self.writer.put(new.message_id, new.slots())
+
+    def add(self, state: LFGState, expires_at: Optional[float] = None) -> LFGPost:
+        """Кладёт сбор в память. expires_at по умолчанию — сейчас + LFG_TTL (как у только что сохранённого)."""
+        if expires_at is None:
+            expires_at = time.time() + LFG_TTL
+        post = LFGPost(state, self._persist, expires_at)
+        self._memory.set_nowait(state.message_id, post)
+        return post
+
+    def update_member_line(self, user_id: int, line: str) -> list[LFGPost]:
+        """Обновляет строку участника во всех сборах в памяти; возвращает сборы, где она изменилась."""
+        return [post for post in self._memory.values_nowait() if not post.closed and post.update_line(user_id, line)]
+
+    def discard(self, message_id: int) -> None:
+        post = self._memory.get_nowait(message_id)
+        if post is not None:
+            post.close()
+        self._memory.delete_nowait(message_id)
+        self.writer.discard(message_id)
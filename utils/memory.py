@@ -0,0 +1,104 @@
+"""Профиль памяти и учёт памяти по подсистемам.
+
+LOW_MEMORY=1 — профиль для небольших хостов: без кэша участников и чанкинга гильдий при старте,
+без кэша сообщений и с меньшим лимитом in-memory кэша (см. main.py и utils/cache.py).
+Отдельные параметры переопределяются CACHE_MAXSIZE и MAX_MESSAGES.
+
+memory_report() раскладывает выделения, отслеживаемые tracemalloc, по подсистемам. tracemalloc
+включается только при старте переменной TRACEMALLOC=1: трассировка замедляет каждое выделение,
+поэтому /memory без неё показывает лишь RSS и размеры кэшей и сам её не включает.
+"""
+import os
+import sys
+import tracemalloc
+from typing import Optional
+
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+# Лимит записей корневого кэша utils.cache.cache; он же потолок для под-кэшей
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1000" if LOW_MEMORY else "10000"))
+# Кэш сообщений discord.py (0 — выключен). Бот не читает сообщения из кэша: LFG правится через partial message
+MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "0" if LOW_MEMORY else "1000"))
+TRACEMALLOC = os.getenv("TRACEMALLOC", "0") == "1"
+# Глубина стека, сохраняемого tracemalloc: нужна, чтобы отнести выделение к подсистеме-вызывающему
+TRACE_FRAMES = 10
+
+# Подсистема выделения — первое правило, совпавшее с любым кадром стека (порядок важен:
+# наши кэши раньше discord.py, потому что заполняются и из обработчиков команд)
+SUBSYSTEMS = (
+    ("LFG", ("utils/lfg.py", "cogs/keys.py", "utils/debounce.py", "utils/writebehind.py")),
+    ("TTL-кэш", ("utils/cache.py", "utils/refresh.py", "utils/snapshots.py", "utils/models.py")),
+    ("Рейтинги", ("utils/leaderboard.py",)),
+    ("БД", ("aiosqlite/", "sqlite3/", "utils/database.py")),
+    ("HTTP", ("aiohttp/", "yarl/", "multidict/", "utils/raiderio.py")),
+    ("discord.py", ("discord/",)),
+)
+
+
+def start_tracing() -> bool:
+    """Включает tracemalloc, если он ещё не включён. True — включили сейчас."""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(TRACE_FRAMES)
+    return True
+
+
+def rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса (Linux) или пиковый (другие Unix); None, если недоступно."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def _subsystem(traceback) -> str:
+    files = [frame.filename.replace("\\", "/") for frame in traceback]
+    for name, patterns in SUBSYSTEMS:
+        if any(pattern in filename for filename in files for pattern in patterns):
+            return name
+    return "Прочее"
+
+
+def allocations_by_subsystem() -> dict[str, tuple[int, int]]:
+    """{подсистема: (байт, блоков)} по текущему снимку tracemalloc."""
+    snapshot = tracemalloc.take_snapshot()
+    result: dict[str, list[int]] = {}
+    for trace in snapshot.traces:
+        entry = result.setdefault(_subsystem(trace.traceback), [0, 0])
+        entry[0] += trace.size
+        entry[1] += 1
+    return {name: (size, count) for name, (size, count) in sorted(result.items(), key=lambda e: -e[1][0])}
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("Б", "КиБ", "МиБ"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГиБ"
+
+
+def memory_report(counts: dict[str, int]) -> str:
+    """Отчёт: RSS, выделения по подсистемам (если tracemalloc включён) и размеры кэшей из counts."""
+    lines = [f"Профиль: {'LOW_MEMORY' if LOW_MEMORY else 'обычный'}"]
+    rss = rss_bytes()
+    if rss is not None:
+        lines.append(f"RSS: {format_bytes(rss)}")
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: {format_bytes(current)} (пик {format_bytes(peak)})")
+        for name, (size, blocks) in allocations_by_subsystem().items():
+            lines.append(f"  {name:<12} {format_bytes(size):>12}  блоков: {blocks}")
+    else:
+        lines.append("tracemalloc выключен (TRACEMALLOC=1 — разбивка по подсистемам)")
+    if counts:
+        lines.append("Объекты:")
+        for name, value in counts.items():
+            lines.append(f"  {name:<24} {value}")
+    return "\n".join(lines)
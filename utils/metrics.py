@@ -0,0 +1,238 @@
+"""Метрики процесса в формате Prometheus (text exposition 0.0.4).
+
+Счётчики, gauge'и и гистограммы объявляются на уровне модуля через counter()/gauge()/histogram()
+(повторное объявление с тем же именем возвращает существующую метрику). Значения, которые
+уже считаются в других местах (статистика кэша, очередей), отдаются коллекторами —
+функциями, вызываемыми при каждом скрейпе. start_server() поднимает /metrics на локальном порту.
+"""
+import functools
+import inspect
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "keymaster_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Образец коллектора: (имя без префикса, тип, описание, метки, значение)
+Sample = tuple[str, str, str, dict, float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счётчики по бакетам..., сумма, количество]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, entry in self._values.items():
+            labels = self._labels(key)
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Метрика {name} уже объявлена как {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+
+        collected: dict[str, tuple[str, str, list[str]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                logger.exception("Ошибка коллектора метрик %r", collector)
+                continue
+            for name, kind, help, labels, value in samples:
+                full = PREFIX + name
+                entry = collected.setdefault(full, (kind, help, []))
+                entry[2].append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+        for name, (kind, help, samples) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+
+
+def instrument_methods(histogram: Histogram, errors: Optional[Counter] = None, exclude: Iterable[str] = (),
+                       span: Optional[str] = None):
+    """Декоратор класса: время каждого публичного async-метода пишется в histogram с меткой method.
+
+    span — префикс спана трассировки (<span>.<method>) для вызовов внутри обработки взаимодействия.
+    """
+    exclude = set(exclude)
+
+    def wrap(name, fn):
+        span_name = f"{span}.{name}" if span else None
+
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(method=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(elapsed, method=name)
+                if span_name:
+                    tracing.record(span_name, elapsed)
+        return timed
+
+    def decorator(cls):
+        for name, fn in list(vars(cls).items()):
+            if not name.startswith("_") and name not in exclude and inspect.iscoroutinefunction(fn):
+                setattr(cls, name, wrap(name, fn))
+        return cls
+
+    return decorator
+
+
+async def start_server(host: str, port: int):
+    """Поднимает HTTP /metrics; возвращает aiohttp AppRunner (остановка — await runner.cleanup())."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("📈 Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,134 @@
+from typing import NamedTuple, Optional
+
+
+class RunSummary(NamedTuple):
+    """Забег M+: только то, что показывают embed'ы."""
+    dungeon: str
+    mythic_level: int
+    num_keystone_upgrades: int
+    score: float
+
+
+def _current_score(data: dict) -> float:
+    try:
+        return data["mythic_plus_scores_by_season"][0]["scores"]["all"]
+    except (KeyError, IndexError, TypeError):
+        return 0
+
+
+def _runs(raw: Optional[list]) -> tuple[RunSummary, ...]:
+    if not raw:
+        return ()
+    return tuple(
+        RunSummary(run.get("dungeon", ""), run.get("mythic_level", 0), run.get("num_keystone_upgrades", 0), run.get("score", 0))
+        for run in raw
+    )
+
+
+class CharacterSnapshot:
+    """Компактная запись персонажа, разобранная один раз из ответа Raider.IO или строки БД.
+
+    realm — slug сервера (как хранится в users.realm_slug), region — код региона.
+    best_runs/weekly_runs пусты, если соответствующие поля не запрашивались.
+    """
+
+    __slots__ = (
+        "discord_id", "name", "realm", "region", "char_class", "rio_score", "item_level",
+        "thumbnail_url", "profile_url", "guild_name", "best_runs", "weekly_runs",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        realm: str,
+        region: str,
+        char_class: Optional[str] = None,
+        rio_score: float = 0,
+        item_level: Optional[int] = None,
+        thumbnail_url: Optional[str] = None,
+        profile_url: Optional[str] = None,
+        guild_name: Optional[str] = None,
+        best_runs: tuple[RunSummary, ...] = (),
+        weekly_runs: tuple[RunSummary, ...] = (),
+        discord_id: Optional[int] = None,
+    ):
+        self.discord_id = discord_id
+        self.name = name
+        self.realm = realm
+        self.region = region
+        self.char_class = char_class
+        self.rio_score = rio_score
+        self.item_level = item_level
+        self.thumbnail_url = thumbnail_url
+        self.profile_url = profile_url
+        self.guild_name = guild_name
+        self.best_runs = best_runs
+        self.weekly_runs = weekly_runs
+
+    def __repr__(self) -> str:
+        return f"<CharacterSnapshot {self.name}-{self.realm} ({self.region}) rio={self.rio_score} ilvl={self.item_level}>"
+
+    @property
+    def stats(self) -> tuple[float, Optional[int]]:
+        """(rio_score, item_level) — то, что показывает LFG."""
+        return self.rio_score, self.item_level
+
+    def for_user(self, discord_id: int) -> "CharacterSnapshot":
+        """Копия с заданным discord_id (общий снимок из кэша не мутируется)."""
+        copy = CharacterSnapshot.__new__(CharacterSnapshot)
+        for attr in self.__slots__:
+            setattr(copy, attr, getattr(self, attr))
+        copy.discord_id = discord_id
+        return copy
+
+    @classmethod
+    def from_raiderio(cls, data: dict, realm: str, region: str, discord_id: Optional[int] = None) -> "CharacterSnapshot":
+        """Разбор ответа /characters/profile. realm/region — slug'и, под которыми персонаж запрошен."""
+        return cls(
+            name=data.get("name", ""),
+            realm=realm,
+            region=region,
+            char_class=data.get("class"),
+            rio_score=_current_score(data),
+            item_level=(data.get("gear") or {}).get("item_level_equipped"),
+            thumbnail_url=data.get("thumbnail_url"),
+            profile_url=data.get("profile_url"),
+            guild_name=(data.get("guild") or {}).get("name"),
+            best_runs=_runs(data.get("mythic_plus_best_runs")),
+            weekly_runs=_runs(data.get("mythic_plus_weekly_highest_level_runs")),
+            discord_id=discord_id,
+        )
+
+    @classmethod
+    def from_row(cls, row) -> "CharacterSnapshot":
+        """Строка users: (discord_id, character_name, realm_slug, region[, rio_score, character_class, thumbnail_url, item_level])."""
+        discord_id, name, realm, region, *rest = row
+        rest = list(rest) + [None] * (4 - len(rest))
+        rio_score, char_class, thumbnail_url, item_level = rest[:4]
+        return cls(
+            name=name, realm=realm, region=region, char_class=char_class, rio_score=rio_score or 0,
+            item_level=item_level, thumbnail_url=thumbnail_url, discord_id=discord_id,
+        )
+
+    def to_dict(self) -> dict:
+        """Компактное представление для хранения снимка (v — версия формата)."""
+        return {
+            "v": 1,
+            "name": self.name, "realm": self.realm, "region": self.region, "class": self.char_class,
+            "rio": self.rio_score, "ilvl": self.item_level, "thumb": self.thumbnail_url,
+            "url": self.profile_url, "guild": self.guild_name,
+            "best": [list(r) for r in self.best_runs], "weekly": [list(r) for r in self.weekly_runs],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, realm: str, region: str) -> "CharacterSnapshot":
+        """Обратное к to_dict(); старые снимки с сырым ответом Raider.IO разбираются через from_raiderio()."""
+        if data.get("v") != 1:
+            return cls.from_raiderio(data, realm, region)
+        return cls(
+            name=data["name"], realm=data["realm"], region=data["region"], char_class=data.get("class"),
+            rio_score=data.get("rio", 0), item_level=data.get("ilvl"), thumbnail_url=data.get("thumb"),
+            profile_url=data.get("url"), guild_name=data.get("guild"),
+            best_runs=tuple(RunSummary(*r) for r in data.get("best", ())),
+            weekly_runs=tuple(RunSummary(*r) for r in data.get("weekly", ())),
+        )
@@ -1,27 +1,170 @@
 import aiohttp
 import logging
 import asyncio
+import os
 import random
-from typing import Optional
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+from utils import jsoncodec, metrics, tracing
+from utils.ratelimit import AdaptiveTokenBucket, parse_retry_after
 
 # Семафор для ограничения параллельных запросов к Raider.IO
-RAIDEROIO_SEMAPHORE = asyncio.Semaphore(5)
+RAIDEROIO_CONCURRENCY = 5
+RAIDEROIO_SEMAPHORE = asyncio.Semaphore(RAIDEROIO_CONCURRENCY)
+
+# Общий token bucket: ограничивает запросы в секунду для всех вызывающих,
+# замедляется на 429 (с учётом Retry-After) и восстанавливается на успешных ответах.
+# Bucket свой у каждого процесса: launcher.py передаёт процессам кластера RAIDERIO_RPS / CLUSTER_COUNT
+# Значения по умолчанию для всего бота (RAIDERIO_RPS и REFRESH_RPS из cogs/profile.py); единственный
+# источник — launcher.py берёт их отсюда, чтобы поделить между процессами кластера
+DEFAULT_RAIDERIO_RPS = 5.0
+DEFAULT_REFRESH_RPS = 4.0
+RAIDEROIO_RPS = float(os.getenv("RAIDERIO_RPS", DEFAULT_RAIDERIO_RPS))
+RAIDEROIO_BUCKET = AdaptiveTokenBucket(rate=RAIDEROIO_RPS, min_rate=0.2)
+
+# Именованные наборы полей профиля: каждый вызывающий запрашивает только то, что показывает.
+# score — рейтинг и ilvl (LFG, фоновое обновление, /register, /update),
+# profile — карточка персонажа (/me, /check), weekly — недельное хранилище (/weekly).
+FIELDS_SCORE = ("gear", "mythic_plus_scores_by_season:current")
+FIELDS_PROFILE = FIELDS_SCORE + ("guild", "mythic_plus_best_runs")
+FIELDS_WEEKLY = ("mythic_plus_weekly_highest_level_runs",)
+FIELDS_FULL = FIELDS_PROFILE + FIELDS_WEEKLY
+FIELD_PROFILES = {
+    "score": FIELDS_SCORE,
+    "profile": FIELDS_PROFILE,
+    "weekly": FIELDS_WEEKLY,
+    "full": FIELDS_FULL,
+}
+
+
+def profile_fields(profile: str) -> frozenset[str]:
+    """Множество полей именованного профиля (KeyError для неизвестного имени)."""
+    return frozenset(FIELD_PROFILES[profile])
+
+
+def fields_param(fields) -> str:
+    """Стабильное значение параметра fields: поля отсортированы, порядок вызова не влияет на ключ."""
+    return ",".join(sorted(fields))
+
 
 # Параметры retry
 MAX_RETRIES = 3
 BASE_DELAY = 0.8  # seconds
 MAX_DELAY = 8.0
 
+# Параметры пула соединений
+POOL_LIMIT = 20            # всего соединений в пуле
+POOL_LIMIT_PER_HOST = 10   # соединений к одному хосту (raider.io)
+DNS_CACHE_TTL = 300        # seconds
+KEEPALIVE_TIMEOUT = 60     # seconds
+REQUEST_TIMEOUT = 10       # seconds, на весь запрос
 
-async def _request_with_retry(url: str, params: dict | None = None) -> Optional[dict]:
-    last_exc = None
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            async with RAIDEROIO_SEMAPHORE:
-                async with aiohttp.ClientSession() as session:
+
+RIO_REQUESTS = metrics.counter("raiderio_requests_total", "HTTP-запросы к Raider.IO по статусу ответа", ["status"])
+RIO_RETRIES = metrics.counter("raiderio_retries_total", "Повторы запросов к Raider.IO по причине", ["reason"])
+RIO_LATENCY = metrics.histogram("raiderio_request_seconds", "Время одного HTTP-запроса к Raider.IO (без ожидания лимитера)")
+RIO_LIMITER_WAIT = metrics.histogram("raiderio_limiter_wait_seconds", "Ожидание токена и семафора перед запросом к Raider.IO")
+
+
+class SingleFlight:
+    """Склеивает одновременные вызовы с одинаковым ключом в один.
+
+    Первый вызывающий запускает задачу, остальные ждут её же результат или исключение.
+    Задача защищена shield(): отмена одного из ожидающих не отменяет запрос для остальных.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Забираем исключение, чтобы не было "exception was never retrieved", если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+
+class RaiderIOClient:
+    """Долгоживущий HTTP-клиент Raider.IO.
+
+    Держит одну aiohttp.ClientSession с keep-alive пулом и DNS-кэшем,
+    поэтому повторные запросы не платят за TCP/TLS-рукопожатие и DNS.
+    Сессия создаётся лениво внутри работающего event loop и закрывается через close().
+    """
+
+    def __init__(
+        self,
+        limit: int = POOL_LIMIT,
+        limit_per_host: int = POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = DNS_CACHE_TTL,
+        keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.limiter = RAIDEROIO_BUCKET
+        self.singleflight = SingleFlight()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, url: str, params: dict | None = None) -> Optional[dict]:
+        last_exc = None
+        params = params or {}
+        for attempt in range(1, MAX_RETRIES + 1):
+            throttled = False
+            try:
+                waited = time.perf_counter()
+                await self.limiter.acquire()
+                async with RAIDEROIO_SEMAPHORE:
+                    started = time.perf_counter()
+                    RIO_LIMITER_WAIT.observe(started - waited)
+                    tracing.record("raiderio.wait", started - waited)
+                    session = self._get_session()
                     async with session.get(url, params=params) as response:
+                        RIO_LATENCY.observe(time.perf_counter() - started)
+                        tracing.record("raiderio.http", time.perf_counter() - started)
+                        RIO_REQUESTS.inc(status=response.status)
                         if response.status == 200:
-                            return await response.json()
+                            self.limiter.on_success()
+                            return jsoncodec.loads(await response.read())
                         elif response.status in (400, 404):
                             # 400 Bad Request or 404 Not Found - treat as no data for this character
                             try:
@@ -40,7 +183,22 @@ async def _request_with_retry(url: str, params: dict | None = None) -> Optional[
                                 }
                             )
                             return None
-                        elif response.status == 429 or 500 <= response.status < 600:
+                        elif response.status == 429:
+                            # Rate limit: пауза для всех вызывающих на Retry-After, повтор без своего backoff
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            self.limiter.on_throttled(retry_after)
+                            throttled = True
+                            logging.getLogger(__name__).warning(
+                                "Raider.IO: HTTP 429, Retry-After=%s, скорость снижена до %.2f запр/с",
+                                retry_after, self.limiter.rate,
+                            )
+                            last_exc = aiohttp.ClientResponseError(
+                                request_info=response.request_info,
+                                history=response.history,
+                                status=response.status,
+                                message=await response.text(),
+                            )
+                        elif 500 <= response.status < 600:
                             # transient error, will retry
                             last_exc = aiohttp.ClientResponseError(
                                 request_info=response.request_info,
@@ -50,34 +208,65 @@ async def _request_with_retry(url: str, params: dict | None = None) -> Optional[
                             )
                         else:
                             response.raise_for_status()
-        except Exception as e:
-            last_exc = e
+            except Exception as e:
+                last_exc = e
+                if not isinstance(e, aiohttp.ClientResponseError):
+                    RIO_REQUESTS.inc(status="error")
+
+            if attempt < MAX_RETRIES:
+                if throttled or isinstance(last_exc, aiohttp.ClientResponseError):
+                    reason = str(last_exc.status)
+                else:
+                    reason = type(last_exc).__name__ if last_exc else "unknown"
+                RIO_RETRIES.inc(reason=reason)
+            # backoff with jitter (после 429 ожидание уже обеспечивает limiter)
+            if attempt < MAX_RETRIES and not throttled:
+                backoff = min(MAX_DELAY, BASE_DELAY * (2 ** (attempt - 1)))
+                jitter = random.uniform(0, backoff * 0.2)
+                await asyncio.sleep(backoff + jitter)
 
-        # backoff with jitter
-        if attempt < MAX_RETRIES:
-            backoff = min(MAX_DELAY, BASE_DELAY * (2 ** (attempt - 1)))
-            jitter = random.uniform(0, backoff * 0.2)
-            await asyncio.sleep(backoff + jitter)
+        # If we exit loop without returning, raise last exception
+        if last_exc:
+            raise last_exc
+        return None
 
-    # If we exit loop without returning, raise last exception
-    if last_exc:
-        raise last_exc
-    return None
 
+# Клиент по умолчанию; владеет им KeyMasterBot (закрывается в bot.close())
+client = RaiderIOClient()
 
-async def get_character_data(name: str, realm: str, region: str) -> Optional[dict]:
+
+def _collect_metrics():
+    limiter = client.limiter
+    yield "raiderio_rate_limit", "gauge", "Текущая разрешённая скорость запросов к Raider.IO (запр/с)", {}, limiter.rate
+    yield "raiderio_limiter_queue", "gauge", "Запросы к Raider.IO, ждущие токена", {}, limiter.queue_depth
+    yield "raiderio_throttled_total", "counter", "Ответы 429 от Raider.IO", {}, limiter.throttled
+    yield "raiderio_singleflight_calls_total", "counter", "Вызовы get_character_data", {}, client.singleflight.calls
+    yield "raiderio_singleflight_shared_total", "counter", "Вызовы, получившие результат уже идущего запроса", {}, client.singleflight.shared
+
+
+metrics.register_collector(_collect_metrics)
+
+
+async def _request_with_retry(url: str, params: dict | None = None) -> Optional[dict]:
+    return await client.request(url, params=params)
+
+
+async def get_character_data(name: str, realm: str, region: str, profile: str = "full") -> Optional[dict]:
+    """Профиль персонажа с полями из FIELD_PROFILES[profile]."""
     url = "https://raider.io/api/v1/characters/profile"
     params = {
         "region": region,
         "realm": realm,
         "name": name,
-        "fields": "gear,guild,mythic_plus_scores_by_season:current,mythic_plus_best_runs,mythic_plus_weekly_highest_level_runs"
+        "fields": fields_param(FIELD_PROFILES[profile]),
     }
 
-    return await _request_with_retry(url, params=params)
+    # Одновременные запросы одного и того же персонажа делят один HTTP-запрос
+    key = (region.lower(), realm.lower(), name.lower(), params["fields"])
+    return await client.singleflight.do(key, lambda: _request_with_retry(url, params=params))
 
 
 async def get_weekly_affixes(region: str = 'eu', locale: str = 'en') -> Optional[dict]:
     url = f"https://raider.io/api/v1/mythic-plus/affixes"
     params = {"region": region, "locale": locale}
-    return await _request_with_retry(url, params=params)
\ No newline at end of file
+    return await _request_with_retry(url, params=params)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveTokenBucket:
+    """Общий на процесс token bucket с адаптивной скоростью (AIMD).
+
+    acquire() выдаёт токены в порядке очереди (FIFO) со скоростью rate в секунду.
+    on_throttled() (ответ 429) вдвое снижает скорость и ставит паузу на Retry-After,
+    on_success() понемногу возвращает скорость к max_rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        min_rate: float = 0.5,
+        max_rate: Optional[float] = None,
+        recovery_step: Optional[float] = None,
+    ):
+        self.max_rate = max_rate or rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.capacity = capacity or max(1.0, rate)
+        # Аддитивный шаг восстановления на каждый успешный ответ
+        self.recovery_step = recovery_step or self.max_rate / 50
+        self._rate = rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self.throttled = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self._rate)
+            self._updated = now
+
+    async def acquire(self) -> None:
+        self._waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if self._paused_until > now:
+                        await asyncio.sleep(self._paused_until - now)
+                        continue
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self._tokens) / self._rate)
+        finally:
+            self._waiting -= 1
+
+    def on_success(self) -> None:
+        if self._rate < self.max_rate:
+            self._refill(time.monotonic())
+            self._rate = min(self.max_rate, self._rate + self.recovery_step)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self.throttled += 1
+        self._rate = max(self.min_rate, self._rate / 2)
+        self._tokens = 0.0
+        pause = retry_after if retry_after is not None else 1.0 / self._rate
+        self._paused_until = max(self._paused_until, now + pause)
+        # Токены не накапливаются во время паузы
+        self._updated = self._paused_until
+
+    def stats(self) -> dict:
+        return {
+            "rate": round(self._rate, 3),
+            "max_rate": self.max_rate,
+            "queue_depth": self._waiting,
+            "tokens": round(self._tokens, 3),
+            "throttled": self.throttled,
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 3)),
+        }
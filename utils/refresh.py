@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from utils import tracing
+from utils.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FRESH = "fresh"
+STALE = "stale"
+EXPIRED = "expired"
+
+
+class RefreshManager:
+    """Stale-while-revalidate поверх именованного под-кэша.
+
+    Запись моложе fresh_ttl — fresh (отдаётся как есть), до stale_ttl — stale
+    (отдаётся сразу, обновление ставится в очередь), дальше — expired
+    (значение берётся через loader, например из БД, и тоже ставится на обновление).
+    На один ключ в работе не больше одного обновления; очередь ограничена max_pending,
+    обновления выполняют workers фоновых воркеров через refresher.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[Hashable], Awaitable[Optional[Any]]],
+        refresher: Callable[[Hashable], Awaitable[Optional[Any]]],
+        *,
+        name: str = "refresh",
+        fresh_ttl: float = 300,
+        stale_ttl: float = 3600,
+        maxsize: int = 5000,
+        max_pending: int = 200,
+        workers: int = 2,
+        refresh_timeout: float = 10,
+    ):
+        self.loader = loader
+        self.refresher = refresher
+        self.name = name
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_timeout = refresh_timeout
+        self.workers = workers
+        # Значение в кэше: (value, stored_at)
+        self._entries = cache.namespace(name, maxsize=maxsize, default_ttl=int(stale_ttl))
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._inflight: set[Hashable] = set()
+        self._worker_tasks: list[asyncio.Task] = []
+        # Вызываются с (key, value) при каждом новом значении (обновление или prime без stale)
+        self.listeners: list[Callable[[Hashable, Any], None]] = []
+        self.metrics = {
+            "fresh": 0,
+            "stale_served": 0,
+            "expired": 0,
+            "refreshed": 0,
+            "refresh_failed": 0,
+            "deduplicated": 0,
+            "dropped": 0,
+        }
+
+    def peek(self, key: Hashable) -> tuple[Optional[Any], str]:
+        """Возвращает (value, state) без побочных эффектов."""
+        entry = self._entries.get_nowait(key)
+        if entry is None:
+            return None, EXPIRED
+        value, stored_at = entry
+        if time.monotonic() - stored_at < self.fresh_ttl:
+            return value, FRESH
+        return value, STALE
+
+    def prime(self, key: Hashable, value: Any, stale: bool = False) -> None:
+        """Кладёт значение в кэш; stale=True — сразу как устаревшее (например, из БД)."""
+        stored_at = time.monotonic()
+        if stale:
+            stored_at -= self.fresh_ttl
+        self._entries.set_nowait(key, (value, stored_at))
+        if not stale:
+            for listener in self.listeners:
+                try:
+                    listener(key, value)
+                except Exception:
+                    logger.exception("%s: ошибка обработчика обновления %r", self.name, key)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.delete_nowait(key)
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        value, state = self.peek(key)
+        if state == FRESH:
+            self.metrics["fresh"] += 1
+            return value
+        if state == STALE:
+            self.metrics["stale_served"] += 1
+            self.schedule(key)
+            return value
+
+        self.metrics["expired"] += 1
+        try:
+            with tracing.span(f"cache.{self.name}.load"):
+                value = await self.loader(key)
+        except Exception:
+            logger.exception("%s: ошибка загрузки %r", self.name, key)
+            value = None
+        if value is not None:
+            self.prime(key, value, stale=True)
+            self.schedule(key)
+        return value
+
+    def schedule(self, key: Hashable) -> bool:
+        """Ставит обновление ключа в очередь. False — уже в работе или очередь заполнена."""
+        if key in self._inflight:
+            self.metrics["deduplicated"] += 1
+            return False
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            self.metrics["dropped"] += 1
+            return False
+        self._inflight.add(key)
+        self._ensure_workers()
+        return True
+
+    def _ensure_workers(self) -> None:
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._queue.get()
+            try:
+                value = await asyncio.wait_for(self.refresher(key), timeout=self.refresh_timeout)
+                if value is not None:
+                    self.prime(key, value)
+                    self.metrics["refreshed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self.metrics["refresh_failed"] += 1
+                logger.warning("%s: таймаут обновления %r", self.name, key)
+            except Exception:
+                self.metrics["refresh_failed"] += 1
+                logger.exception("%s: ошибка обновления %r", self.name, key)
+            finally:
+                self._inflight.discard(key)
+                self._queue.task_done()
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+
+    def stats(self) -> dict:
+        served = self.metrics["fresh"] + self.metrics["stale_served"] + self.metrics["expired"]
+        return {
+            **self.metrics,
+            "stale_ratio": round(self.metrics["stale_served"] / served, 4) if served else 0.0,
+            "pending": self._queue.qsize(),
+            "inflight": len(self._inflight),
+        }
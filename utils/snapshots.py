@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Optional
+
+from utils import jsoncodec, tracing
+from utils.cache import cache
+from utils.models import CharacterSnapshot
+from utils.raiderio import FIELD_PROFILES, fields_param, get_character_data, profile_fields
+
+logger = logging.getLogger(__name__)
+
+# Снимок моложе FRESH_TTL отдаётся без обращения к Raider.IO,
+# снимок старше — тоже отдаётся сразу, но обновляется в фоне (stale-while-revalidate).
+# Снимок старше MAX_AGE считается непригодным: ждём живой запрос.
+SNAPSHOT_FRESH_TTL = int(os.getenv("SNAPSHOT_FRESH_TTL", "900"))
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+SNAPSHOT_MEMORY_SIZE = 2000
+
+
+def snapshot_key(name: str, realm: str, region: str) -> tuple[str, str, str]:
+    """Нормализованный ключ персонажа: (region, realm, name) в нижнем регистре."""
+    return region.strip().lower(), realm.strip().lower(), name.strip().lower()
+
+
+def encode_payload(data: dict) -> bytes:
+    return zlib.compress(jsoncodec.dumps_bytes(data), 6)
+
+
+def decode_payload(payload: bytes) -> dict:
+    return jsoncodec.loads(zlib.decompress(payload))
+
+
+class SnapshotCache:
+    """Кэш профилей Raider.IO: память (LRU) → SQLite (rio_snapshots) → живой запрос.
+
+    Снимки хранятся по (персонаж, набор полей): запрос профиля полей R удовлетворяется
+    любым снимком, чей набор полей включает R (например, score из снимка profile).
+    get() возвращает (CharacterSnapshot, age_seconds). Снимки хранятся в БД сжатыми и с временем
+    получения, поэтому /me, /check и /weekly отвечают сразу даже после рестарта.
+    """
+
+    def __init__(self, db, fresh_ttl: int = SNAPSHOT_FRESH_TTL, max_age: int = SNAPSHOT_MAX_AGE):
+        self.db = db
+        self.fresh_ttl = fresh_ttl
+        self.max_age = max_age
+        # В памяти храним {fields: (CharacterSnapshot, fetched_at)} на персонажа; TTL памяти = max_age,
+        # свежесть считаем по fetched_at
+        self._memory = cache.namespace("snapshots", maxsize=SNAPSHOT_MEMORY_SIZE, default_ttl=max_age)
+        self._revalidating: dict[tuple, asyncio.Task] = {}
+
+    async def _load(self, key: tuple[str, str, str]) -> dict[str, tuple[CharacterSnapshot, float]]:
+        entries = self._memory.get_nowait(key)
+        if entries is not None:
+            return entries
+        entries = {}
+        try:
+            rows = await self.db.get_snapshots(*key)
+        except Exception:
+            logger.exception("Не удалось прочитать снимки %s из БД", key)
+            rows = []
+        for fields, payload, fetched_at in rows:
+            try:
+                snapshot = CharacterSnapshot.from_dict(decode_payload(payload), realm=key[1], region=key[0])
+                entries[fields] = (snapshot, fetched_at)
+            except Exception:
+                logger.warning("Повреждённый снимок %s [%s] в БД, игнорируем", key, fields)
+        self._memory.set_nowait(key, entries)
+        return entries
+
+    @staticmethod
+    def _pick(entries: dict[str, tuple[CharacterSnapshot, float]], wanted: frozenset[str]) -> Optional[tuple[CharacterSnapshot, float]]:
+        """Самый свежий снимок, набор полей которого покрывает wanted."""
+        best = None
+        for fields, entry in entries.items():
+            if wanted.issubset(fields.split(",")) and (best is None or entry[1] > best[1]):
+                best = entry
+        return best
+
+    async def store(self, name: str, realm: str, region: str, snapshot: CharacterSnapshot, profile: str, fetched_at: Optional[float] = None) -> None:
+        """Сохраняет снимок (полученный с профилем полей profile) в память и БД под ключом запроса."""
+        key = snapshot_key(name, realm, region)
+        fields = fields_param(FIELD_PROFILES[profile])
+        fetched_at = fetched_at or time.time()
+        entries = await self._load(key)
+        entries[fields] = (snapshot, fetched_at)
+        self._memory.set_nowait(key, entries)
+        try:
+            await self.db.save_snapshot(*key, fields, encode_payload(snapshot.to_dict()), fetched_at)
+        except Exception:
+            logger.exception("Не удалось сохранить снимок %s в БД", key)
+
+    def snapshot_row(self, name: str, realm: str, region: str, snapshot: CharacterSnapshot, profile: str, fetched_at: Optional[float] = None) -> tuple:
+        """Строка rio_snapshots для пакетной записи вызывающим (фоновое обновление).
+
+        В память снимок попадает, только если персонаж там уже есть: массовый проход не вытесняет
+        из LRU записи интерактивных команд.
+        """
+        key = snapshot_key(name, realm, region)
+        fields = fields_param(FIELD_PROFILES[profile])
+        fetched_at = fetched_at or time.time()
+        entries = self._memory.get_nowait(key)
+        if entries is not None:
+            entries[fields] = (snapshot, fetched_at)
+        return (*key, fields, encode_payload(snapshot.to_dict()), fetched_at)
+
+    async def fetch(self, name: str, realm: str, region: str, profile: str = "score") -> Optional[CharacterSnapshot]:
+        """Живой запрос к Raider.IO с сохранением снимка."""
+        data = await get_character_data(name, realm, region, profile)
+        if not data:
+            return None
+        snapshot = CharacterSnapshot.from_raiderio(data, realm, region)
+        await self.store(name, realm, region, snapshot, profile)
+        return snapshot
+
+    async def get(self, name: str, realm: str, region: str, profile: str = "profile") -> tuple[Optional[CharacterSnapshot], float]:
+        """Возвращает (snapshot, age_seconds). Устаревший снимок отдаётся сразу и обновляется в фоне."""
+        key = snapshot_key(name, realm, region)
+        with tracing.span("cache.snapshots"):
+            entry = self._pick(await self._load(key), profile_fields(profile))
+        if entry is not None:
+            snapshot, fetched_at = entry
+            age = max(0.0, time.time() - fetched_at)
+            if age < self.max_age:
+                if age >= self.fresh_ttl:
+                    self._revalidate(key, name, realm, region, profile)
+                return snapshot, age
+        return await self.fetch(name, realm, region, profile), 0.0
+
+    def _revalidate(self, key: tuple[str, str, str], name: str, realm: str, region: str, profile: str) -> None:
+        task_key = key + (profile,)
+        if task_key in self._revalidating:
+            return
+        task = asyncio.create_task(self._revalidate_task(name, realm, region, profile))
+        self._revalidating[task_key] = task
+        task.add_done_callback(lambda _t, k=task_key: self._revalidating.pop(k, None))
+
+    async def _revalidate_task(self, name: str, realm: str, region: str, profile: str) -> None:
+        try:
+            await self.fetch(name, realm, region, profile)
+        except Exception as e:
+            logger.warning("Фоновое обновление снимка %s-%s (%s) не удалось: %s", name, realm, region, e)
+
+
+def format_age(age: float) -> str:
+    """Человекочитаемый возраст данных для подписи embed."""
+    if age < 60:
+        return "только что"
+    minutes = int(age // 60)
+    if minutes < 60:
+        return f"{minutes} мин назад"
+    hours = minutes // 60
+    if hours < 48:
+        return f"{hours} ч назад"
+    return f"{hours // 24} дн назад"
@@ -0,0 +1,58 @@
+"""Профиль запуска бота: длительность фаз setup_hook и загрузки каждого кога.
+
+Группа ext — вызов load_extension кога целиком (импорт модуля и setup(), отдельно импорт не меряется);
+коги грузятся по очереди, параллельно с ними идёт только подготовка хранилища. Поэтому для каждой
+фазы хранится смещение от старта и длительность; итог — время от создания профиля до mark_ready().
+"""
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready_at: Optional[float] = None
+        # (группа, имя, смещение от старта, длительность, ошибка)
+        self.entries: list[tuple[str, str, float, float, Optional[str]]] = []
+
+    @contextmanager
+    def phase(self, name: str, group: str = "phase") -> Iterator[None]:
+        """Замер блока кода (в том числе содержащего await)."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.perf_counter() - start, group, error)
+
+    def record(self, name: str, start: float, duration: float, group: str = "phase", error: Optional[str] = None) -> None:
+        self.entries.append((group, name, start - self.started, duration, error))
+
+    def mark_ready(self) -> None:
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+
+    @property
+    def total(self) -> Optional[float]:
+        return None if self.ready_at is None else self.ready_at - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "entries": [
+                {"group": g, "name": n, "offset": round(o, 4), "duration": round(d, 4), "error": e}
+                for g, n, o, d, e in self.entries
+            ],
+        }
+
+    def report(self) -> str:
+        total = self.total
+        lines = [f"Запуск: {total:.2f} с до ready" if total is not None else "Запуск: ещё не ready"]
+        for group, name, offset, duration, error in sorted(self.entries, key=lambda e: e[2]):
+            suffix = f"  ✖ {error}" if error else ""
+            lines.append(f"  [{group:<6}] {name:<28} +{offset:6.2f} с  {duration * 1000:8.1f} мс{suffix}")
+        return "\n".join(lines)
@@ -0,0 +1,233 @@
+"""Трассировка обработки взаимодействий: от получения до первого ответа и до конца обработчика.
+
+Трасса живёт в contextvar задачи, обрабатывающей взаимодействие: start_trace() вызывается
+в CommandTree.interaction_check (слэш-команды) или декоратором traced() (кнопки), span()
+из любого слоя (БД, Raider.IO, кэш) добавляет в текущую трассу отрезок. Ответы Discord трассированного
+взаимодействия идут через его собственный TracedInteractionResponse (спаны discord.* и первый ответ).
+Вне трассы span() ничего не делает. Спаны включающие: raiderio внутри cache.snapshots учитывается в обоих.
+
+По завершении длительности попадают в скользящее окно по команде (percentiles()), а трассы
+с первым ответом медленнее TRACE_SLOW_MS пишутся в лог с разбивкой по спанам.
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1500"))
+# Сколько последних трасс на команду хранить для перцентилей
+TRACE_WINDOW = 1000
+
+
+class Trace:
+    __slots__ = ("name", "started", "receive", "first_response", "total", "spans", "finished")
+
+    def __init__(self, name: str, receive: float = 0.0):
+        self.name = name
+        self.started = time.perf_counter()
+        # От создания взаимодействия в Discord (snowflake) до начала обработки, сек
+        self.receive = receive
+        self.first_response: Optional[float] = None
+        self.total: Optional[float] = None
+        # имя спана -> [суммарная длительность, число]
+        self.spans: dict[str, list[float]] = {}
+        self.finished = False
+
+    def add_span(self, name: str, duration: float) -> None:
+        if self.finished:
+            return
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [duration, 1]
+        else:
+            entry[0] += duration
+            entry[1] += 1
+
+    def mark_response(self) -> None:
+        if self.first_response is None and not self.finished:
+            self.first_response = time.perf_counter() - self.started
+
+    def breakdown(self) -> str:
+        parts = [f"receive {self.receive * 1000:.0f}"]
+        for name, (duration, count) in sorted(self.spans.items(), key=lambda e: -e[1][0]):
+            parts.append(f"{name} {duration * 1000:.0f}" + (f" ×{count}" if count > 1 else ""))
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# команда -> окно (до первого ответа, всего), мс
+_windows: dict[str, deque[tuple[float, float]]] = {}
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def start_trace(name: str, interaction=None) -> Trace:
+    """Начинает трассу в текущем контексте и завершает её вместе с текущей задачей."""
+    receive = 0.0
+    created_at = getattr(interaction, "created_at", None)
+    if created_at is not None:
+        receive = max(0.0, time.time() - created_at.timestamp())
+    trace = Trace(name, receive)
+    _current.set(trace)
+    if interaction is not None:
+        _trace_responses(interaction, trace)
+    task = asyncio.current_task()
+    if task is not None:
+        task.add_done_callback(lambda _: finish(trace))
+    return trace
+
+
+def finish(trace: Trace) -> None:
+    if trace.finished:
+        return
+    trace.total = time.perf_counter() - trace.started
+    trace.finished = True
+    first = trace.first_response if trace.first_response is not None else trace.total
+    window = _windows.get(trace.name)
+    if window is None:
+        window = _windows[trace.name] = deque(maxlen=TRACE_WINDOW)
+    window.append(((trace.receive + first) * 1000, (trace.receive + trace.total) * 1000))
+    if (trace.receive + first) * 1000 >= TRACE_SLOW_MS:
+        logger.warning(
+            "🐢 %s: %.0f мс до первого ответа (всего %.0f мс): %s",
+            trace.name, (trace.receive + first) * 1000, (trace.receive + trace.total) * 1000, trace.breakdown(),
+        )
+
+
+def record(name: str, duration: float) -> None:
+    """Добавляет уже измеренный отрезок (сек) в текущую трассу."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, duration)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - start)
+
+
+def traced(name: str):
+    """Декоратор callback'а компонента: трасса на время вызова (если её ещё нет)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, interaction, *args, **kwargs):
+            if _current.get() is not None:
+                return await fn(self, interaction, *args, **kwargs)
+            trace = start_trace(name, interaction)
+            try:
+                return await fn(self, interaction, *args, **kwargs)
+            finally:
+                finish(trace)
+        return wrapper
+    return decorator
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[idx]
+
+
+def percentiles() -> dict[str, dict[str, float]]:
+    """{команда: {n, p50, p95, p99 (до первого ответа, мс), total_p95}}."""
+    result = {}
+    for name, window in _windows.items():
+        first = [f for f, _ in window]
+        total = [t for _, t in window]
+        result[name] = {
+            "n": len(window),
+            "p50": _percentile(first, 0.50),
+            "p95": _percentile(first, 0.95),
+            "p99": _percentile(first, 0.99),
+            "total_p95": _percentile(total, 0.95),
+        }
+    return result
+
+
+def latency_report() -> str:
+    stats = percentiles()
+    if not stats:
+        return "Трасс пока нет"
+    lines = [f"{'команда':<22} {'n':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'всего p95':>10}  (мс до первого ответа)"]
+    for name, s in sorted(stats.items(), key=lambda e: -e[1]["p95"]):
+        lines.append(f"{name:<22} {s['n']:>5} {s['p50']:>7.0f} {s['p95']:>7.0f} {s['p99']:>7.0f} {s['total_p95']:>10.0f}")
+    return "\n".join(lines)
+
+
+_response_cls = None
+
+
+def _response_class():
+    """Подкласс discord.InteractionResponse, пишущий спаны discord.* и момент первого ответа (создаётся лениво)."""
+    global _response_cls
+    if _response_cls is not None:
+        return _response_cls
+    import discord
+
+    class TracedInteractionResponse(discord.InteractionResponse):
+        __slots__ = ("_trace",)
+
+        def __init__(self, parent, trace: Trace):
+            super().__init__(parent)
+            self._trace = trace
+
+        @contextmanager
+        def _responding(self, name: str) -> Iterator[None]:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._trace.add_span(f"discord.{name}", time.perf_counter() - start)
+                self._trace.mark_response()
+
+        async def send_message(self, *args, **kwargs):
+            with self._responding("send_message"):
+                return await super().send_message(*args, **kwargs)
+
+        async def defer(self, *args, **kwargs):
+            with self._responding("defer"):
+                return await super().defer(*args, **kwargs)
+
+        async def edit_message(self, *args, **kwargs):
+            with self._responding("edit_message"):
+                return await super().edit_message(*args, **kwargs)
+
+        async def send_modal(self, *args, **kwargs):
+            with self._responding("send_modal"):
+                return await super().send_modal(*args, **kwargs)
+
+    _response_cls = TracedInteractionResponse
+    return _response_cls
+
+
+def _trace_responses(interaction, trace: Trace) -> None:
+    """Подменяет ответ только у этого взаимодействия (классы discord.py не меняются).
+
+    Первым ответом считается любой из методов ответа (defer тоже): в этот момент Discord получил
+    подтверждение. Follow-up'ы после defer отдельными спанами не пишутся — они входят в общее время.
+    """
+    try:
+        # Interaction.response — кэшируемое свойство со слотом _cs_response; до ответа его можно заменить
+        if not interaction.response.is_done():
+            interaction._cs_response = _response_class()(interaction, trace)
+    except AttributeError:
+        pass
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RatePacer:
+    """Равномерно раздаёт «слоты» старта не чаще rate раз в секунду.
+
+    Общий для всех воркеров одного прохода: каждый acquire() резервирует
+    следующий свободный слот и спит до него.
+    """
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = (1.0 / rate) if rate and rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PassReport:
+    """Итог прохода пула воркеров."""
+
+    __slots__ = ("name", "total", "processed", "failed", "skipped", "started_at", "duration")
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.duration = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.processed + self.failed + self.skipped
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.done}/{self.total} за {self.duration:.1f} с "
+            f"(успешно {self.processed}, пропущено {self.skipped}, ошибок {self.failed})"
+        )
+
+
+async def run_worker_pool(
+    items: Iterable[Any],
+    handler: Callable[[Any], Awaitable[Optional[bool]]],
+    *,
+    workers: int,
+    rate: Optional[float] = None,
+    name: str = "pass",
+    progress_every: float = 10.0,
+) -> PassReport:
+    """Прогоняет items через handler в workers параллельных воркеров.
+
+    handler возвращает False, если элемент пропущен, иначе элемент считается обработанным;
+    исключения логируются и считаются ошибками, не прерывая проход.
+    rate — целевое число стартов в секунду на весь проход (None — без ограничения).
+    Прогресс пишется в лог не чаще раза в progress_every секунд.
+    """
+    items = list(items)
+    report = PassReport(name, len(items))
+    if not items:
+        return report
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, workers) * 2)
+    pacer = RatePacer(rate)
+    last_progress = time.monotonic()
+
+    async def producer():
+        for item in items:
+            await queue.put(item)
+
+    async def worker():
+        nonlocal last_progress
+        while True:
+            item = await queue.get()
+            try:
+                await pacer.acquire()
+                result = await handler(item)
+                if result is False:
+                    report.skipped += 1
+                else:
+                    report.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                report.failed += 1
+                logger.exception("%s: ошибка обработки элемента %r", name, item)
+            finally:
+                queue.task_done()
+
+            now = time.monotonic()
+            if now - last_progress >= progress_every:
+                last_progress = now
+                logger.info(
+                    "⏳ %s: %d/%d (%.0f%%), %.1f с",
+                    name, report.done, report.total, 100.0 * report.done / report.total, now - report.started_at,
+                )
+
+    worker_tasks = [asyncio.create_task(worker()) for _ in range(max(1, min(workers, len(items))))]
+    try:
+        await producer()
+        await queue.join()
+    finally:
+        for task in worker_tasks:
+            task.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        report.duration = time.monotonic() - report.started_at
+    return report
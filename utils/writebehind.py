@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Отложенная запись со склейкой по ключу.
+
+    put() только запоминает последнее значение для ключа (повторные обновления
+    того же ключа между сбросами склеиваются), фоновая задача раз в interval секунд
+    передаёт накопленное в flush_fn одним пакетом — одна транзакция вместо commit'а на каждое изменение.
+    close() останавливает цикл и сбрасывает остаток.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[list[tuple[Hashable, Any]]], Awaitable[None]],
+        interval: float = 0.25,
+        name: str = "write-behind",
+    ):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.name = name
+        self._pending: dict[Hashable, Any] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"enqueued": 0, "merged": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.stats["enqueued"] += 1
+        if key in self._pending:
+            self.stats["merged"] += 1
+        self._pending[key] = value
+        self._wakeup.set()
+
+    def pending(self, key: Hashable, default: Any = None) -> Any:
+        """Ещё не записанное значение для ключа."""
+        return self._pending.get(key, default)
+
+    def discard(self, key: Hashable) -> None:
+        """Отменяет ещё не записанное обновление (например, запись удалена)."""
+        self._pending.pop(key, None)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Копим изменения в течение окна, затем пишем одним пакетом
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записывает всё накопленное одним вызовом flush_fn. Возвращает число записанных ключей."""
+        async with self._flush_lock:
+            self._wakeup.clear()
+            if not self._pending:
+                return 0
+            batch = self._pending
+            self._pending = {}
+            try:
+                await self.flush_fn(list(batch.items()))
+            except asyncio.CancelledError:
+                # Отмена посреди записи (остановка): пакет остаётся для финального сброса в close()
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                raise
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("%s: ошибка записи пакета из %d элементов", self.name, len(batch))
+                # Возвращаем неудавшийся пакет, не затирая более свежие значения
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                self._wakeup.set()
+                return 0
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(batch)
+            return len(batch)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()